@@ -0,0 +1,156 @@
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from flightlog import FlightLog
+
+AXES = ["Roll", "Pitch", "Yaw"]
+# Target changes below this many degrees per frame count as a held set point
+STEADY_RATE = 0.05
+MIN_STEP = 2.0
+SETTLING_BAND = 0.05
+MIN_BAND = 0.5
+SATURATION = 0.98
+
+COLUMNS = [
+    ("duration", "Time s", ".1f"),
+    ("rmsRoll", "RMS R", ".2f"),
+    ("rmsPitch", "RMS P", ".2f"),
+    ("rmsYaw", "RMS Y", ".2f"),
+    ("overshootRoll", "OS% R", ".1f"),
+    ("overshootPitch", "OS% P", ".1f"),
+    ("overshootYaw", "OS% Y", ".1f"),
+    ("settlingRoll", "Ts R", ".2f"),
+    ("settlingPitch", "Ts P", ".2f"),
+    ("settlingYaw", "Ts Y", ".2f"),
+    ("saturation", "Sat %", ".1f"),
+    ("sag", "Sag mV", ".0f"),
+]
+
+
+def steps(target: np.ndarray, actual: np.ndarray, timestamp: np.ndarray) -> tuple:
+    # Each held set point that follows a move of at least MIN_STEP is treated as a step response
+    steady = np.abs(np.diff(target, prepend=target[0])) < STEADY_RATE
+    edges = np.diff(steady.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    overshoots = []
+    settlings = []
+    for k in range(1, len(starts)):
+        start, stop = starts[k], stops[k]
+        amplitude = target[start] - target[stops[k - 1] - 1]
+        if abs(amplitude) < MIN_STEP:
+            continue
+        error = actual[start:stop] - target[start:stop]
+        overshoots.append(max(0.0, np.max(error * np.sign(amplitude)) / abs(amplitude) * 100))
+        outside = np.flatnonzero(np.abs(error) > max(SETTLING_BAND * abs(amplitude), MIN_BAND))
+        if len(outside) == 0:
+            settlings.append(0.0)
+        elif outside[-1] + 1 < stop - start:
+            settlings.append(timestamp[start + outside[-1] + 1] - timestamp[start])
+    overshoot = float(np.mean(overshoots)) if len(overshoots) > 0 else float("nan")
+    settling = float(np.mean(settlings)) if len(settlings) > 0 else float("nan")
+    return overshoot, settling
+
+
+def analyzeLog(path: str) -> dict:
+    result = dict(log=os.path.basename(path))
+    try:
+        data = FlightLog(path).table()
+    except (OSError, ValueError) as error:
+        result["error"] = str(error)
+        return result
+    timestamp = data[:, 14]
+    armed = data[:, 13] != 0
+    result["frames"] = len(data)
+    result["duration"] = float(timestamp[-1] - timestamp[0]) if len(data) > 1 else 0.0
+    if not armed.any():
+        result["error"] = "never armed"
+        return result
+
+    flight = data[armed]
+    time = flight[:, 14]
+    dt = np.diff(time, append=time[-1])
+    for axis, name in enumerate(AXES):
+        error = flight[:, axis] - flight[:, axis + 3]
+        if axis == 2:
+            error = (error + 180) % 360 - 180
+        result["rms" + name] = float(np.sqrt(np.mean(error**2)))
+        result["maxError" + name] = float(np.max(np.abs(error)))
+        result["overshoot" + name], result["settling" + name] = steps(flight[:, axis + 3], flight[:, axis], time)
+
+    saturated = np.any(flight[:, 6:10] >= SATURATION, axis=1)
+    result["saturationTime"] = float(np.sum(dt[saturated]))
+    result["saturation"] = float(np.mean(saturated) * 100)
+
+    voltage = data[:, 11]
+    rest = voltage[~armed]
+    rest = np.percentile(rest, 95) if len(rest) > 0 else voltage[0]
+    result["minVoltage"] = float(np.min(flight[:, 11]))
+    result["sag"] = float(rest - result["minVoltage"])
+    return result
+
+
+def _row(name: str, cells: list) -> str:
+    return "{:<28}".format(name[:28]) + "".join("{:>9}".format(cell) for cell in cells)
+
+
+def summary(results: list) -> str:
+    header = _row("Log", [title for _, title, _ in COLUMNS])
+    lines = [header, "-" * len(header)]
+    for result in results:
+        if "error" in result:
+            lines.append("{:<28} {}".format(result["log"], result["error"]))
+        else:
+            lines.append(_row(result["log"], [format(result[key], spec) for key, _, spec in COLUMNS]))
+    good = [result for result in results if "error" not in result]
+    if len(good) > 1:
+        lines.append("-" * len(header))
+        cells = []
+        for key, _, spec in COLUMNS:
+            values = np.array([result[key] for result in good])
+            # Logs without a step response have no overshoot or settling time
+            cells.append(format(np.nanmean(values), spec) if not np.all(np.isnan(values)) else "nan")
+        lines.append(_row("mean of {} logs".format(len(good)), cells))
+    return "\n".join(lines)
+
+
+def writeCsv(path: str, results: list) -> None:
+    keys = ["log", "frames", "error"]
+    for result in results:
+        keys.extend(key for key in result if key not in keys)
+    with open(path, "w") as file:
+        file.write(",".join(keys) + "\n")
+        for result in results:
+            file.write(",".join(str(result.get(key, "")) for key in keys) + "\n")
+
+
+def findLogs(paths: list, pattern: str) -> list:
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs.extend(sorted(glob.glob(os.path.join(path, "**", pattern), recursive=True)))
+        else:
+            logs.append(path)
+    return logs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch analysis of recorded flight logs")
+    parser.add_argument("paths", nargs="+", help="flight logs or directories containing them")
+    parser.add_argument("--pattern", default="*.gslog", help="file pattern used inside directories")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--csv", default=None, help="also write every metric to this CSV file")
+    args = parser.parse_args()
+
+    logs = findLogs(args.paths, args.pattern)
+    if len(logs) == 0:
+        sys.exit("no flight logs found")
+    # Whole logs per task, the metrics themselves are vectorized inside each worker
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(logs)))) as pool:
+        results = list(pool.map(analyzeLog, logs))
+    print(summary(results))
+    if args.csv is not None:
+        writeCsv(args.csv, results)
@@ -0,0 +1,551 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import codec
+from connection import Telemetry, BlackBox, Tower, Fleet
+from devices import Controls, XboxController, DEADZONE, EXPO
+from events import Event
+
+
+class NullSignal(object):
+    def emit(self, *args) -> None:
+        pass
+
+
+def timeCalls(function, repeat: int) -> dict:
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(i)
+        samples[i] = time.perf_counter() - start
+    return dict(
+        mean_ms=float(np.mean(samples) * 1000),
+        p50_ms=float(np.median(samples) * 1000),
+        p95_ms=float(np.percentile(samples, 95) * 1000),
+        max_ms=float(np.max(samples) * 1000),
+    )
+
+
+def makeFrames(count: int) -> list:
+    frames = []
+    for _ in range(count):
+        frames.append(
+            codec.FRAME.pack(
+                codec.TELEMETRY_TYPE,
+                random.randint(0, 1),
+                random.randint(0, 5000),
+                *[random.randint(-14400, 14400) for _ in range(3)],
+                *[random.randint(3277, 6554) for _ in range(4)],
+                random.randint(9000, 12600),
+                *[random.randint(-14400, 14400) for _ in range(3)],
+            )
+        )
+    return frames
+
+
+def makeFlight(count: int, rate: float = 50.0) -> np.ndarray:
+    # Smooth synthetic flight, random frames make every plotted line a full height zigzag
+    t = np.arange(count) / rate
+    raw = np.zeros(count, dtype=codec.DTYPE)
+    raw["type"] = codec.TELEMETRY_TYPE
+    raw["armed"] = 1
+    raw["cycletime"] = 2500 + np.random.randint(-50, 50, count)
+    for axis, period in enumerate((7.0, 11.0, 29.0)):
+        target = 20 * np.sin(2 * np.pi * t / period) * codec.ATTITUDE_SCALE
+        raw["targetAttitude"][:, axis] = target
+        raw["attitude"][:, axis] = target + np.random.normal(0, 0.5 * codec.ATTITUDE_SCALE, count)
+    for engine in range(4):
+        raw["engines"][:, engine] = 5000 + 600 * np.sin(2 * np.pi * t / (3.0 + engine))
+    raw["voltage"] = np.linspace(4200, 3600, count).astype(np.uint16) * codec.VOLTAGE_DIVIDER
+    return raw
+
+
+class LegacyTelemetry(object):
+    # The list based state every field of which the receiver used to overwrite in place
+    def __init__(self) -> None:
+        self.engines = [0.0, 0.0, 0.0, 0.0]
+        self.attitude = [0.0, 0.0, 0.0]
+        self.targetAttitude = [0.0, 0.0, 0.0]
+        self.cycletime = 0
+        self.armed = False
+        self.voltage = 0
+
+
+def legacyDecode(telemetry: LegacyTelemetry, data: bytes) -> None:
+    telemetry.armed = struct.unpack("B", data[1:2])[0] != 0
+    telemetry.cycletime = struct.unpack("H", data[2:4])[0]
+    telemetry.attitude[0] = struct.unpack("h", data[4:6])[0] / 160.0
+    telemetry.attitude[1] = struct.unpack("h", data[6:8])[0] / 160.0
+    telemetry.attitude[2] = struct.unpack("h", data[8:10])[0] / 160.0
+    telemetry.engines[0] = (struct.unpack("H", data[10:12])[0] - 3277) / 3277
+    telemetry.engines[1] = (struct.unpack("H", data[12:14])[0] - 3277) / 3277
+    telemetry.engines[2] = (struct.unpack("H", data[14:16])[0] - 3277) / 3277
+    telemetry.engines[3] = (struct.unpack("H", data[16:18])[0] - 3277) / 3277
+    telemetry.voltage = int(struct.unpack("H", data[18:20])[0] / 3)
+    telemetry.targetAttitude[0] = struct.unpack("h", data[20:22])[0] / 160.0
+    telemetry.targetAttitude[1] = struct.unpack("h", data[22:24])[0] / 160.0
+    telemetry.targetAttitude[2] = struct.unpack("h", data[24:26])[0] / 160.0
+
+
+def benchDecode(frames: list, batch: int) -> dict:
+    legacy = LegacyTelemetry()
+    telemetry = Telemetry()
+    results = dict()
+
+    start = time.perf_counter()
+    for data in frames:
+        if data[0] == codec.TELEMETRY_TYPE:
+            legacyDecode(legacy, data)
+    results["legacy"] = len(frames) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for data in frames:
+        if data[0] == codec.TELEMETRY_TYPE:
+            telemetry.publish(codec.unpack(data))
+    results["struct"] = len(frames) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for offset in range(0, len(frames), batch):
+        raw = codec.decodeBatch(frames[offset : offset + batch])
+        codec.scale(raw)
+        telemetry.publish(codec.unpack(raw[-1:].tobytes()))
+    results["batch"] = len(frames) / (time.perf_counter() - start)
+    return results
+
+
+def makeTower(port: int = 4321) -> Tower:
+    tower = Tower(target="127.0.0.1", port=port)
+    tower.connectSignals(NullSignal(), NullSignal(), NullSignal(), NullSignal())
+    tower.connectClasses(Telemetry(), BlackBox(compact=True), Controls())
+    return tower
+
+
+def benchTelemetry(frames: list, burst: int = 64) -> dict:
+    # Real datagrams over loopback, bursts stay well inside the socket receive buffer
+    results = dict()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(("127.0.0.1", 0))
+    for compact in (False, True):
+        tower = makeTower(sender.getsockname()[1])
+        tower.blackbox = BlackBox(compact=compact)
+        tower.blackbox.start_recording()
+        tower.connected = True
+        batches = []
+        callback = tower.endpoint.telemetryCallback
+        tower.endpoint.telemetryCallback = lambda datagrams, arrivals: (
+            batches.append(len(datagrams)),
+            callback(datagrams, arrivals),
+        )
+        addr = ("127.0.0.1", tower.protocol.socket.getsockname()[1])
+        start = time.perf_counter()
+        for offset in range(0, len(frames), burst):
+            for data in frames[offset : offset + burst]:
+                sender.sendto(data, addr)
+            while tower.blackbox.index < offset:
+                time.sleep(0)
+        while tower.blackbox.index < len(frames) and time.perf_counter() - start < 30:
+            time.sleep(0.0005)
+        elapsed = time.perf_counter() - start
+        results["compact" if compact else "float"] = dict(
+            framesPerSecond=tower.blackbox.index / elapsed,
+            lost=len(frames) - tower.blackbox.index,
+            meanBatch=float(np.mean(batches)),
+        )
+        tower.connected = False
+    sender.close()
+    return results
+
+
+GamepadEvent = namedtuple("GamepadEvent", ["code", "state", "timestamp"])
+
+
+def benchControl(duration: float, rate: float) -> dict:
+    import simulator
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, args=())
+    thread.daemon = True
+    thread.start()
+    transport, _ = asyncio.run_coroutine_threadsafe(simulator.serve(port=0, rate=rate), loop).result()
+    port = transport.get_extra_info("sockname")[1]
+
+    results = dict()
+    for mode in ("polled", "eventDriven", "resting"):
+        tower = makeTower(port)
+        if mode == "polled":
+            # Stick changes wait for the next keepalive, as before the sender could be woken
+            tower.controls.changed.disconnect(tower._onControls)
+        controller = XboxController(tower.controls, 1)
+        controller.connectSignals(NullSignal(), NullSignal())
+        tower.getHandshake("127.0.0.1")
+        tower.runControl()
+        # Stick moves at irregular 2 to 15 ms intervals, stamped like HID events. At rest a 1 kHz pad
+        # only reports sensor noise inside the deadzone
+        end = time.perf_counter() + duration
+        state = 0
+        while time.perf_counter() < end:
+            if mode == "resting":
+                controller.feed([GamepadEvent("ABS_X", random.randint(-200, 200), time.time())])
+                time.sleep(0.001)
+                continue
+            state = (state + 997) % 65536 - 32768
+            controller.feed([GamepadEvent("ABS_X", state, time.time())])
+            time.sleep(random.uniform(0.002, 0.015))
+        tower.controlled = False
+        jitter = tower.getControlJitter()
+        jitter["target"] = tower.signalRate
+        results[mode] = dict(
+            jitter=jitter,
+            inputLatency=tower.getInputLatency(),
+            framesPerSecond=tower.getLinkStats()["Control"]["sent"] / duration,
+        )
+    loop.call_soon_threadsafe(transport.close)
+    return results
+
+
+def legacyAxis(controls: Controls, event: GamepadEvent) -> None:
+    # The per event curve of the old if/elif chain
+    for code, attribute, sign in (("ABS_Y", "ly", -1), ("ABS_X", "lx", 1), ("ABS_RY", "ry", -1), ("ABS_RX", "rx", 1)):
+        if event.code == code:
+            value = sign * event.state / 32768
+            if abs(value) > DEADZONE:
+                value = math.copysign(
+                    math.pow(abs((value - math.copysign(DEADZONE, value)) / (1 - DEADZONE)), EXPO), value
+                )
+            else:
+                value = 0
+            setattr(controls, attribute, value)
+            return
+
+
+def benchGamepad(count: int, duration: float) -> dict:
+    states = np.random.randint(-32768, 32768, count).tolist()
+    codes = ["ABS_X", "ABS_Y", "ABS_RX", "ABS_RY"]
+    events = [GamepadEvent(codes[i % 4], state, 0.0) for i, state in enumerate(states)]
+    controls = Controls()
+    controller = XboxController(controls, 1)
+    rates = dict()
+    start = time.perf_counter()
+    for event in events:
+        legacyAxis(controls, event)
+    rates["legacy"] = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for event in events:
+        axis = controller.axes[event.code]
+        setattr(controls, axis.attribute, axis(event.state))
+    rates["lookup"] = count / (time.perf_counter() - start)
+    # What the reader thread pays per event for reads of eight events
+    start = time.perf_counter()
+    for k in range(0, count, 8):
+        controller.feed(events[k : k + 8])
+    rates["feed"] = count / (time.perf_counter() - start)
+    controller.events = 0
+
+    # A 1 kHz gamepad delivering one event per read, every published state costs the GUI a repaint
+    signals = []
+    published = Event()
+    published.connect(lambda: signals.append(time.perf_counter()))
+    controller.connectSignals(published, NullSignal())
+    controller.flushThread = threading.Thread(target=controller._flush, args=())
+    controller.flushThread.daemon = True
+    controller.flushThread.start()
+    sent = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        controller.feed(events[sent % count : sent % count + 1])
+        sent += 1
+        time.sleep(0.001)
+    return dict(
+        eventsPerSecond=rates,
+        fed=sent,
+        signalsPerSecond=len(signals) / duration,
+        coalesced=controller.events / max(1, len(signals)),
+    )
+
+
+def benchFleet(vehicles: int, duration: float, rate: float) -> dict:
+    import simulator
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, args=())
+    thread.daemon = True
+    thread.start()
+    transports = [
+        asyncio.run_coroutine_threadsafe(simulator.serve(port=0, rate=rate), loop).result()[0] for _ in range(vehicles)
+    ]
+
+    fleet = Fleet()
+    towers = [fleet.add("127.0.0.1", transport.get_extra_info("sockname")[1]) for transport in transports]
+    start = time.perf_counter()
+    fleet.connectAll()
+    while not all(tower.connected for tower in towers) and time.perf_counter() - start < 10:
+        time.sleep(0.01)
+    connect = time.perf_counter() - start
+    generations = [tower.telemetry.generation for tower in towers]
+    time.sleep(duration)
+    rates = [(tower.telemetry.generation - first) / duration for tower, first in zip(towers, generations)]
+    jitter = [tower.getControlJitter()["std"] * 1000 for tower in towers]
+    for tower in towers:
+        fleet.remove(tower)
+    for transport in transports:
+        loop.call_soon_threadsafe(transport.close)
+    return dict(
+        vehicles=vehicles,
+        connected=sum(tower.connected or tower.telemetry.generation > 0 for tower in towers),
+        connectSeconds=connect,
+        telemetryRate=dict(min=min(rates), mean=float(np.mean(rates)), target=rate),
+        controlJitterStdMs=dict(mean=float(np.mean(jitter)), max=max(jitter)),
+    )
+
+
+def benchPaint(repeat: int) -> dict:
+    from classes import Horizon, Heading, DroneThrust, ControlStick
+
+    horizon = Horizon(None, size=(900, 900))
+    heading = Heading()
+    thrust = DroneThrust()
+    stick = ControlStick(size=(300, 300))
+    wave = np.sin(np.linspace(0, 20 * np.pi, repeat))
+    return dict(
+        Horizon=timeCalls(lambda i: horizon.update(30 * wave[i], 45 * wave[i], 1000, 3700), repeat),
+        Heading=timeCalls(lambda i: heading.update(180 * wave[i]), repeat),
+        DroneThrust=timeCalls(lambda i: thrust.update(wave[i], -wave[i], wave[i] / 2, 0.5), repeat),
+        ControlStick=timeCalls(lambda i: stick.update(wave[i], -wave[i]), repeat),
+    )
+
+
+def legacyAddItem(view, model, parents: dict, group: str, child: str, value: float, id: int) -> None:
+    # The old per parameter slot, the whole tree is expanded again after every row
+    from PyQt5.QtGui import QStandardItem
+
+    if group not in parents:
+        parents[group] = QStandardItem(group)
+        model.appendRow([parents[group], QStandardItem("None"), QStandardItem("None")])
+    parents[group].appendRow([QStandardItem(child), QStandardItem(str(round(value, 6))), QStandardItem(str(id))])
+    view.expandAll()
+
+
+def benchConfig(counts: tuple = (27, 200, 1000)) -> dict:
+    from PyQt5.QtGui import QStandardItemModel
+    from classes import Configuration
+
+    results = dict()
+    for count in counts:
+        parameters = [("Group {}".format(id // 10), "Parameter {}".format(id), id * 0.5, id) for id in range(count)]
+        config = Configuration()
+        config.getWidget().show()
+        start = time.perf_counter()
+        model = QStandardItemModel(0, 3, config.tv)
+        config.tv.setModel(model)
+        parents = dict()
+        for parameter in parameters:
+            legacyAddItem(config.tv, model, parents, *parameter)
+        legacy = time.perf_counter() - start
+        start = time.perf_counter()
+        config.load(parameters)
+        bulk = time.perf_counter() - start
+        start = time.perf_counter()
+        for id in range(count):
+            config.changeColor(id, "#00a000")
+        colour = time.perf_counter() - start
+        results[str(count)] = dict(legacy_ms=legacy * 1000, load_ms=bulk * 1000, colourAll_ms=colour * 1000)
+    return results
+
+
+def benchPlot(repeat: int, frames: int) -> dict:
+    from plots import PlotCanvas
+
+    raw = makeFlight(frames)
+    results = dict()
+    for series in (1, 2, 4, 8, 14):
+        blackbox = BlackBox()
+        canvas = PlotCanvas()
+        canvas.resize(1000, 800)
+        canvas.setBlackBox(blackbox)
+        canvas.start(list(range(series)))
+        blackbox.start_recording()
+        blackbox.recordFrames(raw[: canvas.window_size])
+        step = max(1, (len(raw) - canvas.window_size) // repeat)
+
+        def draw(i):
+            offset = canvas.window_size + i * step
+            blackbox.recordFrames(raw[offset : offset + step])
+            canvas.drawPlot()
+
+        results[str(series)] = timeCalls(draw, repeat)
+        blackbox.stop_recording()
+    return results
+
+
+def benchLog(frames: int) -> dict:
+    import flightlog
+
+    raw = makeFlight(frames)
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    results = dict()
+    for compact in (False, True):
+        blackbox = BlackBox(compact=compact)
+        blackbox.start_recording()
+        blackbox.recordFrames(raw)
+        path = os.path.join(directory, "flight-{}.gslog".format(int(compact)))
+        writer = flightlog.LogWriter(blackbox, path)
+        start = time.perf_counter()
+        writer.start()
+        writer.stop()
+        write = time.perf_counter() - start
+        log = flightlog.FlightLog(path)
+
+        start = time.perf_counter()
+        log.table()
+        read = time.perf_counter() - start
+        exports = dict()
+        for extension in ("csv", "npz"):
+            start = time.perf_counter()
+            flightlog.exportLog(os.path.join(directory, "flight.{}".format(extension)), log)
+            exports[extension] = len(log) / (time.perf_counter() - start)
+
+        # As fast as possible replay is the deterministic load for the instrument path
+        replay = flightlog.Replay(log, Telemetry(), speed=0)
+        replay.start()
+        replay.wait()
+        results["compact" if compact else "float"] = dict(
+            bytesPerFrame=writer.bytes / len(log),
+            writeFramesPerSecond=len(log) / write,
+            readFramesPerSecond=len(log) / read,
+            exportFramesPerSecond=exports,
+            replayFramesPerSecond=replay.frames / replay.elapsed,
+        )
+    return results
+
+
+def importTimes(output: str, top: int = 10) -> dict:
+    # Parses the stderr of python -X importtime, nesting is two spaces per level after the first
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(own) / 1000, int(cumulative) / 1000, depth))
+    toplevel = [module for module in modules if module[3] == 0]
+    return dict(
+        total_ms=sum(module[2] for module in toplevel),
+        cumulative_ms={name: total for name, _, total, _ in sorted(toplevel, key=lambda m: -m[2])[:top]},
+        self_ms={name: own for name, own, _, _ in sorted(modules, key=lambda m: -m[1])[:top]},
+    )
+
+
+def benchStartup() -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    results = dict()
+    start = time.perf_counter()
+    headless = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import headless, startup; print(startup.maxRss())"],
+        cwd=here,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    results["headless"] = dict(
+        wall_ms=(time.perf_counter() - start) * 1000,
+        maxRss_mb=float(headless.stdout.split()[-1]),
+        imports=importTimes(headless.stderr),
+    )
+    start = time.perf_counter()
+    gui = subprocess.run(
+        [sys.executable, "-X", "importtime", "main.py", "--profile-startup"],
+        cwd=here,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    report = json.loads(gui.stdout[gui.stdout.index("{") :])
+    # The graphs are built after the first paint, only the laps before them are startup
+    laps = report.pop("laps_ms")
+    graphs = laps.pop("graphs")
+    results["gui"] = dict(
+        wall_ms=(time.perf_counter() - start) * 1000,
+        firstPaint_ms=sum(laps.values()),
+        graphs_ms=graphs,
+        widgets_ms=laps,
+        imports=importTimes(gui.stderr),
+        **report,
+    )
+    return results
+
+
+SUITES = ["decode", "telemetry", "control", "gamepad", "fleet", "paint", "config", "plot", "log", "startup"]
+
+
+def run(args) -> dict:
+    frames = makeFrames(args.frames)
+    results = dict()
+    if "decode" in args.suite:
+        results["decode"] = {name: dict(framesPerSecond=rate) for name, rate in benchDecode(frames, args.batch).items()}
+    if "telemetry" in args.suite:
+        results["telemetry"] = benchTelemetry(frames)
+    if "log" in args.suite:
+        results["log"] = benchLog(args.frames)
+    if "control" in args.suite:
+        results["control"] = benchControl(args.duration, args.rate)
+    if "gamepad" in args.suite:
+        results["gamepad"] = benchGamepad(args.frames, args.duration)
+    if "fleet" in args.suite:
+        results["fleet"] = benchFleet(args.vehicles, args.duration, args.rate)
+    if "startup" in args.suite:
+        results["startup"] = benchStartup()
+    if {"paint", "config", "plot"} & set(args.suite):
+        from PyQt5.QtWidgets import QApplication
+
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+        if "paint" in args.suite:
+            results["paint"] = benchPaint(args.repeat)
+        if "config" in args.suite:
+            results["config"] = benchConfig()
+        if "plot" in args.suite:
+            results["plot"] = benchPlot(args.repeat, args.frames)
+    return dict(
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        arguments=vars(args),
+        results=results,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless ground station benchmarks")
+    parser.add_argument("--suite", nargs="+", choices=SUITES, default=SUITES)
+    parser.add_argument("--frames", type=int, default=200000, help="telemetry frames for the decode suites")
+    parser.add_argument("--batch", type=int, default=64, help="datagrams per batch decode")
+    parser.add_argument("--repeat", type=int, default=200, help="frames per paint and plot measurement")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of control traffic")
+    parser.add_argument("--vehicles", type=int, default=24, help="simulated copters for the fleet suite")
+    parser.add_argument("--rate", type=float, default=50.0, help="simulated telemetry rate for the control suite")
+    parser.add_argument("--output", default=None, help="JSON result file, printed to stdout if omitted")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
@@ -1,5 +1,18 @@
+import time
 from math import cos, sin
-from PyQt5.QtGui import QPainter, QPen, QBrush, QPolygon, QPixmap, QColor, QFont, QStandardItemModel, QStandardItem
+from PyQt5.QtGui import (
+    QPainter,
+    QPainterPath,
+    QPen,
+    QBrush,
+    QPolygon,
+    QPixmap,
+    QColor,
+    QFont,
+    QFontMetrics,
+    QStandardItemModel,
+    QStandardItem,
+)
 from PyQt5.QtWidgets import (
     QLabel,
     QTreeView,
@@ -8,14 +21,12 @@ from PyQt5.QtWidgets import (
     QVBoxLayout,
     QListWidget,
     QPushButton,
-    QSizePolicy,
     QAbstractItemView,
+    QFileDialog,
 )
 from PyQt5.QtCore import Qt, QPoint
-import numpy as np
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-from connection import Telemetry, BlackBox
+from connection import Telemetry, BlackBox, WRITTEN, FAILED
+from flightlog import exportBlackBox
 
 
 class Heading:
@@ -136,71 +147,134 @@ class ControlStick:
 
 
 class Horizon:
+    # Padding around the cached layers so pens and glyphs are not clipped
+    PAD = 20
+
     def __init__(self, parent=None, size=(1000, 1000)):
         self.label = QLabel()
-        self.size = size
         self.parent = parent
-        canvas = QPixmap(size[0], size[1])
-        self.label.setPixmap(canvas)
         self.ground = QColor("#9c3e00")
         self.sky = QColor("#00bfff")
         self.black = QColor("#000000")
         self.grey = QColor("#D0D0D0")
         self.red = QColor("#FF0000")
+        self.valueFont = QFont("Decorative", 13)
+        self.valuePen = QPen(self.black, 10, Qt.PenStyle.SolidLine)
+        self.rungPen = QPen(self.black, 2, Qt.PenStyle.SolidLine)
+        self.resize(size)
+
+    def resize(self, size):
+        self.size = size
+        canvas = QPixmap(size[0], size[1])
+        self.label.setPixmap(canvas)
+        self.rungs = None
+        self.labels = None
+        self.bezel = dict()
+
+    def _renderLayer(self, x0, y0, x1, y1, draw):
+        layer = QPixmap(x1 - x0, y1 - y0)
+        layer.fill(Qt.transparent)
+        painter = QPainter(layer)
+        painter.translate(-x0, -y0)
+        draw(painter)
+        painter.end()
+        return (x0, y0, layer)
+
+    def _renderLadder(self):
+        self.rungs = QPainterPath()
+        self.labels = []
+        font = QFont("Decorative", 10)
+        metrics = QFontMetrics(font)
+
+        def drawLabel(text):
+            def draw(painter):
+                painter.setFont(font)
+                painter.setPen(self.rungPen)
+                painter.drawText(0, 0, text)
+
+            return draw
+
+        for x in range(-9, 9):
+            y = int(self.size[1] * x / 9)
+            width = int(self.size[0] / 6) if x % 2 == 0 else int(self.size[0] / 12)
+            self.rungs.moveTo(-width, y)
+            self.rungs.lineTo(width, y)
+            if x % 2 == 0:
+                text = "{}°".format(10 * x)
+                x0, y0, layer = self._renderLayer(
+                    -2,
+                    -metrics.ascent() - 2,
+                    metrics.horizontalAdvance(text) + 2,
+                    metrics.descent() + 2,
+                    drawLabel(text),
+                )
+                self.labels.append((x0, y + y0, layer))
+
+    def _renderBezel(self, lowVoltage):
+        def drawLeft(painter):
+            painter.setPen(self.rungPen)
+            painter.setBrush(QBrush(self.red if lowVoltage else self.grey, 1))
+            painter.drawRect(-int(self.size[0] / 3.95) - 100, -40, 100, 80)
+            painter.setPen(self.valuePen)
+            painter.drawLine(
+                int(-self.size[0] / 4), int(+self.size[1] / 3), int(-self.size[0] / 4), int(-self.size[1] / 3)
+            )
+            painter.setFont(QFont("Decorative", 9))
+            painter.drawText(-int(self.size[0] / 3.05), 30, "V")
+
+        def drawRight(painter):
+            painter.setPen(self.rungPen)
+            painter.setBrush(QBrush(self.grey, 1))
+            painter.drawRect(int(self.size[0] / 3.95), -40, 100, 80)
+            painter.setPen(self.valuePen)
+            painter.drawLine(
+                int(self.size[0] / 4), int(+self.size[1] / 3), int(self.size[0] / 4), int(-self.size[1] / 3)
+            )
+            painter.setFont(QFont("Decorative", 9))
+            painter.drawText(int(self.size[0] / 3.4), 30, "mm")
+
+        outer = int(self.size[0] / 3.95) + 100 + Horizon.PAD
+        inner = int(self.size[0] / 4) - Horizon.PAD
+        height = int(self.size[1] / 3) + Horizon.PAD
+        self.bezel[lowVoltage] = [
+            self._renderLayer(-outer, -height, -inner, height, drawLeft),
+            self._renderLayer(inner, -height, outer, height, drawRight),
+        ]
 
     def update(self, pitchDeg=0, rollDeg=0, altitude=0, voltage=0):
         roll = rollDeg * 3.14159 / 180
         pitch = pitchDeg * 3.14159 / 180
+        lowVoltage = voltage < 3500
+        if self.rungs is None:
+            self._renderLadder()
+        if lowVoltage not in self.bezel:
+            self._renderBezel(lowVoltage)
 
         painter = QPainter(self.label.pixmap())
-        painter.setPen(QPen(self.ground, 1, Qt.PenStyle.SolidLine))
-        painter.setBrush(QBrush(self.ground, 1))
-        painter.drawRect(0, 0, self.size[0], self.size[1])
-
         painter.translate(
             self.size[0] / 2 - sin(-roll) * sin(pitch) * self.size[0] / 2,
             self.size[0] / 2 + pitchDeg * self.size[1] / 100 * cos(-roll),
         )
-
-        painter.setPen(QPen(self.sky, 1, Qt.PenStyle.SolidLine))
-        painter.setBrush(QBrush(self.sky, 1))
-
         painter.rotate(-rollDeg)
-        painter.drawRect(int(-self.size[0]), int(-self.size[0] * 2), int(self.size[0] * 2), int(self.size[1] * 2))
-        painter.setFont(QFont("Decorative", 10))
-        painter.setPen(QPen(self.black, 2, Qt.PenStyle.SolidLine))
-        for x in range(-9, 9):
-            if x % 2 == 0:
-                painter.drawText(0, int(self.size[1] * x / 9), "{}°".format(10 * x))
-                painter.drawLine(
-                    int(-self.size[0] / 6), int(self.size[1] * x / 9), int(self.size[0] / 6), int(self.size[1] * x / 9)
-                )
-            else:
-                painter.drawLine(
-                    int(-self.size[0] / 12),
-                    int(self.size[1] * x / 9),
-                    int(self.size[0] / 12),
-                    int(self.size[1] * x / 9),
-                )
-
-        painter.rotate(rollDeg)
-        painter.translate(sin(-roll) * sin(pitch) * self.size[0] / 2, -pitchDeg * self.size[1] / 100 * cos(-roll))
-        painter.setBrush(QBrush(self.grey, 1))
-        painter.drawRect(int(self.size[0] / 3.95), -40, 100, 80)
-        if voltage < 3500:
-            painter.setBrush(QBrush(self.red, 1))
-        painter.drawRect(-int(self.size[0] / 3.95) - 100, -40, 100, 80)
-
-        painter.setPen(QPen(self.black, 10, Qt.PenStyle.SolidLine))
-        painter.drawLine(int(-self.size[0] / 4), int(+self.size[1] / 3), int(-self.size[0] / 4), int(-self.size[1] / 3))
-        painter.drawLine(int(self.size[0] / 4), int(+self.size[1] / 3), int(self.size[0] / 4), int(-self.size[1] / 3))
-        painter.setFont(QFont("Decorative", 13))
-
+        # Sky and ground each cover their half once instead of painting the ground twice
+        painter.fillRect(
+            int(-self.size[0] * 2), int(-self.size[0] * 2), int(self.size[0] * 4), int(self.size[1] * 2), self.sky
+        )
+        painter.fillRect(int(-self.size[0] * 2), 0, int(self.size[0] * 4), int(self.size[1] * 2), self.ground)
+        painter.setPen(self.rungPen)
+        painter.drawPath(self.rungs)
+        for x, y, layer in self.labels:
+            painter.drawPixmap(x, y, layer)
+
+        painter.resetTransform()
+        painter.translate(self.size[0] / 2, self.size[0] / 2)
+        for x, y, layer in self.bezel[lowVoltage]:
+            painter.drawPixmap(x, y, layer)
+
+        painter.setPen(self.valuePen)
+        painter.setFont(self.valueFont)
         painter.drawText(-int(self.size[0] / 2.9), 0, "{:04d}".format(int(voltage)))
         painter.drawText(int(self.size[0] / 3.7), 0, "{:04d}".format(int(altitude)))
-        painter.setFont(QFont("Decorative", 9))
-        painter.drawText(-int(self.size[0] / 3.05), 30, "V")
-        painter.drawText(int(self.size[0] / 3.4), 30, "mm")
 
         painter.end()
         # self.root.update()
@@ -209,12 +283,97 @@ class Horizon:
         return self.label
 
 
+class LinkOverlay:
+    def __init__(self, parent=None):
+        self.label = QLabel(parent)
+        self.label.setStyleSheet("background-color: rgba(0, 0, 0, 140); color: #ffffff; padding: 4px;")
+        self.label.setFont(QFont("Monospace", 9))
+        self.label.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.label.move(10, 10)
+        self.label.setVisible(False)
+
+    def update(self, stats: dict):
+        lines = []
+        for name, link in stats.items():
+            line = "{:<16} {:6.1f} Hz  loss {:5.1f}%".format(name, link["rate"], link["loss"] * 100)
+            if link["gaps"]["count"] > 0 and link["received"] > 0:
+                line += "  gap p95 {:6.1f} ms".format(link["gaps"]["p95"] * 1000)
+            if link["rtt"]["count"] > 0:
+                line += "  rtt p50 {:6.1f} ms".format(link["rtt"]["p50"] * 1000)
+            if "jitter" in link and link["jitter"]["count"] > 0:
+                line += "  jitter p99 {:6.1f} ms".format(link["jitter"]["p99"] * 1000)
+            if "inputLatency" in link and link["inputLatency"]["count"] > 0:
+                line += "  input p95 {:6.1f} ms".format(link["inputLatency"]["p95"] * 1000)
+            if link["requests"] == 0 and link["age"] is not None and link["age"] > 1.0:
+                line += "  silent {:.0f} s".format(link["age"])
+            lines.append(line)
+        self.label.setText("\n".join(lines))
+        self.label.adjustSize()
+        self.label.setVisible(len(lines) > 0)
+
+    def getWidget(self):
+        return self.label
+
+
+class RedrawScheduler:
+    def __init__(self, timer, interval=25, idleInterval=100, maxInterval=100, idleFrames=40, budget=0.5):
+        self.timer = timer
+        self.interval = interval
+        self.idleInterval = idleInterval
+        self.maxInterval = maxInterval
+        self.idleFrames = idleFrames
+        # Share of the frame interval painting may use before the frame rate is lowered
+        self.budget = budget
+        self.entries = []
+        self.generation = None
+        self.controlDirty = False
+        self.idle = 0
+        self.paintTime = 0.0
+
+    def addWidget(self, values, thresholds, draw, control=False):
+        self.entries.append(dict(values=values, thresholds=thresholds, draw=draw, control=control, last=None))
+
+    def markControl(self):
+        self.controlDirty = True
+        if self.timer.interval() > self.interval:
+            self.idle = 0
+            self.timer.setInterval(self.interval)
+
+    def frame(self, snapshot):
+        # Every widget of one frame reads the same telemetry snapshot
+        start = time.perf_counter()
+        telemetryChanged = snapshot.generation != self.generation
+        self.generation = snapshot.generation
+        drawn = False
+        for entry in self.entries:
+            if entry["last"] is not None and not (self.controlDirty if entry["control"] else telemetryChanged):
+                continue
+            values = entry["values"](snapshot)
+            last = entry["last"]
+            if last is None or any(abs(v - l) >= t for v, l, t in zip(values, last, entry["thresholds"])):
+                entry["draw"](*values)
+                entry["last"] = values
+                drawn = True
+        self.controlDirty = False
+
+        if drawn:
+            self.idle = 0
+            self.paintTime = 0.8 * self.paintTime + 0.2 * (time.perf_counter() - start)
+        else:
+            self.idle += 1
+        interval = self.interval if self.idle < self.idleFrames else self.idleInterval
+        interval = int(max(interval, min(self.maxInterval, self.paintTime * 1000 / self.budget)))
+        if interval != self.timer.interval():
+            self.timer.setInterval(interval)
+        return drawn
+
+
 class Configuration:
     def __init__(self, parent=None):
         self.parent = parent
-        self.marked = set()
-        self.diff = dict()
-        self.parents = dict()
+        # id -> [name, value, id] items of the parameter row
+        self.items = dict()
+        self.dirty = set()
 
         self.fe = QFrame()
         self.lt = QVBoxLayout()
@@ -228,171 +387,76 @@ class Configuration:
         self.tv = QTreeView()
         self.lt.addWidget(self.tv)
 
-        self.ml = QStandardItemModel(0, 3, self.tv)
-        self.ml.setHeaderData(0, Qt.Horizontal, "Name")
-        self.ml.setHeaderData(1, Qt.Horizontal, "Value")
-        self.ml.setHeaderData(2, Qt.Horizontal, "ID")
+        self.ml = self._model()
         self.tv.setModel(self.ml)
 
         self.tv.doubleClicked.connect(self._onEdit)
         self.tv.expandAll()
 
-    def addParent(self, name):
-        nametem = QStandardItem(str(name))
-        nametem.setEditable(False)
-        nonetem = QStandardItem("None")
-        nonetem.setEditable(False)
-        noidtem = QStandardItem("None")
-        noidtem.setEditable(False)
-        self.ml.appendRow([nametem, nonetem, noidtem])
-        self.parents[name] = nametem
-
-    def addItem(self, group, child, value, id):
-        nametem = QStandardItem(str(child))
-        nametem.setEditable(False)
-        idtem = QStandardItem(str(id))
-        idtem.setEditable(False)
-        valuetem = QStandardItem(str(round(value, 6)))
-        if group not in self.parents.keys():
-            self.addParent(group)
-        self.parents[group].appendRow([nametem, valuetem, idtem])
+    def _model(self):
+        model = QStandardItemModel(0, 3, self.tv)
+        model.setHeaderData(0, Qt.Horizontal, "Name")
+        model.setHeaderData(1, Qt.Horizontal, "Value")
+        model.setHeaderData(2, Qt.Horizontal, "ID")
+        return model
+
+    def _row(self, name, value, id, editable=False):
+        row = [QStandardItem(str(name)), QStandardItem(value), QStandardItem(str(id))]
+        for item in row:
+            item.setEditable(False)
+        row[1].setEditable(editable)
+        return row
+
+    def load(self, parameters):
+        # The tree is built off the view and swapped in, one reset and one expandAll for the whole table
+        model = self._model()
+        groups = dict()
+        self.items = dict()
+        self.dirty = set()
+        for group, child, value, id in parameters:
+            if group not in groups:
+                groups[group] = self._row(group, "None", "None")
+                model.appendRow(groups[group])
+            row = self._row(child, str(round(value, 6)), id, editable=True)
+            groups[group][0].appendRow(row)
+            self.items[id] = row
+        old = self.ml
+        self.ml = model
+        self.tv.setModel(model)
+        old.deleteLater()
         self.tv.expandAll()
 
     def _onEdit(self, index):
-        if index.column() == 1 and index.sibling(index.row(), 1).data() != "None":
-            # print(index.parent().row(), index.row(), index.sibling(index.row(), 1).data())
-            # print(
-            self.ml.setData(index.sibling(index.row(), 0), QBrush(Qt.blue), Qt.ForegroundRole)
-            self.ml.setData(index.sibling(index.row(), 1), QBrush(Qt.blue), Qt.ForegroundRole)
-            self.ml.setData(index.sibling(index.row(), 2), QBrush(Qt.blue), Qt.ForegroundRole)
-            self.marked.add(str(index.parent().row()) + ":" + str(index.row()))
+        id = index.sibling(index.row(), 2).data()
+        if index.column() == 1 and id != "None":
+            self.dirty.add(int(id))
+            self.changeColor(int(id), "#0000ff")
 
     def getDiff(self):
-        for loc in self.marked:
-            row = loc.split(":")
-            row_parent = int(row[0])
-            row_child = int(row[1])
-            self.diff[loc] = (
-                self.ml.index(row_child, 2, parent=self.ml.index(row_parent, 0)).data(),
-                self.ml.index(row_child, 1, parent=self.ml.index(row_parent, 0)).data(),
-            )
-        self.marked.clear()
-        return self.diff
-
-    def changeColor(self, location, color):
-        row = location.split(":")
-        row_parent = int(row[0])
-        row_child = int(row[1])
-        self.ml.setData(
-            self.ml.index(row_child, 0, parent=self.ml.index(row_parent, 0)), QBrush(QColor(color)), Qt.ForegroundRole
-        )
-        self.ml.setData(
-            self.ml.index(row_child, 1, parent=self.ml.index(row_parent, 0)), QBrush(QColor(color)), Qt.ForegroundRole
-        )
-        self.ml.setData(
-            self.ml.index(row_child, 2, parent=self.ml.index(row_parent, 0)), QBrush(QColor(color)), Qt.ForegroundRole
-        )
-        pass
+        diff = dict()
+        for id in self.dirty:
+            try:
+                diff[id] = float(self.items[id][1].text())
+            except ValueError:
+                self.changeColor(id, FAILED)
+        return diff
+
+    def changeColor(self, id, color):
+        if id not in self.items:
+            return
+        brush = QBrush(QColor(color))
+        for item in self.items[id]:
+            item.setForeground(brush)
+        if color == WRITTEN:
+            self.dirty.discard(id)
 
     def clear(self):
-        self.parents = dict()
-        self.ml.clear()
-        self.ml = QStandardItemModel(0, 3, self.tv)
-        self.ml.setHeaderData(0, Qt.Horizontal, "Name")
-        self.ml.setHeaderData(1, Qt.Horizontal, "Value")
-        self.ml.setHeaderData(2, Qt.Horizontal, "ID")
-        self.tv.setModel(self.ml)
+        self.load([])
 
     def getWidget(self):
         return self.fe
 
 
-class PlotCanvas(FigureCanvas):
-    def __init__(self, parent=None, width=10, height=8, dpi=100):
-        fig = Figure(figsize=(width, height), dpi=dpi)
-        FigureCanvas.__init__(self, fig)
-        self.setParent(parent)
-        FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
-        FigureCanvas.updateGeometry(self)
-        self.index2plot = []
-        self.window_size = 100
-        self.ax = self.figure.add_subplot(111)
-        self.ax.set_title("PyQt Matplotlib Example")
-        self.colors = ["r-", "g-", "b-", "y-", "c-", "m-", "k-"]
-        self.draw()
-
-    def setBlackBox(self, blackbox: BlackBox):
-        self.blackbox = blackbox
-
-    def start(self, index2plot):
-        self.index2plot = index2plot
-        self.ax.cla()
-        self.ax.set_title("PyQt Matplotlib Example")
-        self.lines = []
-
-    def updatePlot(self, index2plot):
-        if self.blackbox.index < self.window_size:
-            return
-        self.index2plot = index2plot
-        self.lines = []
-        lim_max = []
-        lim_min = []
-        for i in index2plot:
-            lim_max.append(np.max(self.blackbox.storage[: self.blackbox.index, i]))
-            lim_min.append(np.min(self.blackbox.storage[: self.blackbox.index, i]))
-        self.ax.cla()
-        if self.blackbox.recording:
-            window_size = self.window_size
-        else:
-            window_size = self.blackbox.index
-        for x, i in enumerate(self.index2plot):
-            (line,) = self.ax.plot(
-                range(self.window_size),
-                self.blackbox.storage[self.blackbox.index - window_size : self.blackbox.index, i],
-                self.colors[x % 8],
-                linewidth=1,
-                label=self.blackbox.labels[i],
-            )
-            self.lines.append(line)
-        self.ax.set_ylim([min(lim_min), max(lim_max)])
-        self.ax.legend()
-        self.draw()
-
-    def end(self):
-        self.ax.cla()
-        for x, i in enumerate(self.index2plot):
-            self.ax.plot(
-                self.blackbox.timestamp[: self.blackbox.index],
-                self.blackbox.storage[: self.blackbox.index, i],
-                self.colors[x % 8],
-                linewidth=0.5,
-                label=self.blackbox.labels[i],
-            )
-        self.ax.legend()
-        self.draw()
-
-    def drawPlot(self):
-        if not self.blackbox.recording:
-            return
-        if self.blackbox.index >= self.window_size and len(self.lines) == 0:
-            for x, i in enumerate(self.index2plot):
-                (line,) = self.ax.plot(
-                    range(self.window_size),
-                    self.blackbox.storage[self.blackbox.index - self.window_size : self.blackbox.index, i],
-                    self.colors[x % 8],
-                    linewidth=1,
-                    label=self.blackbox.labels[i],
-                )
-                self.lines.append(line)
-            self.ax.legend()
-        if self.blackbox.index > self.window_size:
-            for x, i in enumerate(self.index2plot):
-                self.lines[x].set_ydata(
-                    self.blackbox.storage[self.blackbox.index - self.window_size : self.blackbox.index, i]
-                )
-        self.draw()
-
-
 class DataSelector:
     def __init__(self, parent=None, width=300) -> None:
         self.parent = parent
@@ -427,9 +491,15 @@ class DataSelector:
         self.bpue.clicked.connect(self.updatePlot)
         self.lt.addWidget(self.bpue)
 
-    def setPointer(self, canvas: PlotCanvas, blackbox: BlackBox):
+        self.bpex = QPushButton(self.fe)
+        self.bpex.setText("Export")
+        self.bpex.clicked.connect(self.export)
+        self.lt.addWidget(self.bpex)
+
+    def setPointer(self, canvas: "PlotCanvas", blackbox: BlackBox, spectrum: "SpectrumCanvas" = None):
         self.canvas = canvas
         self.blackbox = blackbox
+        self.spectrum = spectrum
         self.list.addItems(self.blackbox.labels)
 
     def toggleRecording(self):
@@ -439,10 +509,14 @@ class DataSelector:
             for item in self.list.selectedItems():
                 selectedIndex.append(self.list.indexFromItem(item).row())
             self.canvas.start(selectedIndex)
+            if self.spectrum is not None:
+                self.spectrum.start(selectedIndex)
             self.blackbox.start_recording()
         else:
             self.bpst.setText("Start Recording")
             self.canvas.end()
+            if self.spectrum is not None:
+                self.spectrum.end()
             self.blackbox.stop_recording()
 
     def updatePlot(self):
@@ -452,5 +526,10 @@ class DataSelector:
         self.canvas.updatePlot(selectedIndex)
         pass
 
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self.fe, "Export recording", "", "CSV (*.csv);;NumPy (*.npz)")
+        if path:
+            exportBlackBox(path, self.blackbox)
+
     def getWidget(self):
         return self.fe
@@ -0,0 +1,88 @@
+import struct
+import numpy as np
+
+TELEMETRY_TYPE = 10
+
+# type, armed, cycletime, roll, pitch, yaw, engine 1-4, voltage, target roll, target pitch, target yaw
+FRAME = struct.Struct("<BBHhhhHHHHHhhh")
+
+DTYPE = np.dtype(
+    [
+        ("type", "u1"),
+        ("armed", "u1"),
+        ("cycletime", "<u2"),
+        ("attitude", "<i2", (3,)),
+        ("engines", "<u2", (4,)),
+        ("voltage", "<u2"),
+        ("targetAttitude", "<i2", (3,)),
+    ]
+)
+
+# Packed BlackBox record: the wire frame without its type byte plus timestamp and altitude
+RECORD_DTYPE = np.dtype([("timestamp", "<f4"), ("altitude", "<i4")] + DTYPE.descr[1:])
+
+ATTITUDE_SCALE = 160.0
+ENGINE_OFFSET = 3277
+VOLTAGE_DIVIDER = 3
+
+# Column layout of BlackBox.storage
+COLUMNS = 14
+
+
+def unpack(data: bytes) -> tuple:
+    return FRAME.unpack_from(data)
+
+
+def encode(row) -> tuple:
+    # Scaled values in BlackBox column order back to a wire frame tuple
+    return (
+        TELEMETRY_TYPE,
+        int(row[13] != 0),
+        int(row[12]),
+        *[int(round(x * ATTITUDE_SCALE)) for x in row[0:3]],
+        *[int(round(x * ENGINE_OFFSET + ENGINE_OFFSET)) for x in row[6:10]],
+        int(row[11]) * VOLTAGE_DIVIDER,
+        *[int(round(x * ATTITUDE_SCALE)) for x in row[3:6]],
+    )
+
+
+def quantize(frame, timestamp: float) -> tuple:
+    raw = frame.raw
+    return (timestamp, int(frame.altitude), raw[1], raw[2], raw[3:6], raw[6:10], raw[10], raw[11:14])
+
+
+# Wire frame of a disarmed vehicle at rest
+IDLE = (TELEMETRY_TYPE, 0, 0, 0, 0, 0, ENGINE_OFFSET, ENGINE_OFFSET, ENGINE_OFFSET, ENGINE_OFFSET, 0, 0, 0, 0)
+
+
+def decodeBatch(datagrams) -> np.ndarray:
+    frames = [data for data in datagrams if len(data) == FRAME.size and data[0] == TELEMETRY_TYPE]
+    return np.frombuffer(b"".join(frames), dtype=DTYPE)
+
+
+def scaleColumn(raw: np.ndarray, column: int) -> np.ndarray:
+    if column < 3:
+        return raw["attitude"][:, column] / ATTITUDE_SCALE
+    if column < 6:
+        return raw["targetAttitude"][:, column - 3] / ATTITUDE_SCALE
+    if column < 10:
+        return (raw["engines"][:, column - 6].astype(np.float64) - ENGINE_OFFSET) / ENGINE_OFFSET
+    if column == 10:
+        return raw["altitude"].astype(np.float64)
+    if column == 11:
+        return (raw["voltage"] // VOLTAGE_DIVIDER).astype(np.float64)
+    if column == 12:
+        return raw["cycletime"].astype(np.float64)
+    return (raw["armed"] != 0).astype(np.float64)
+
+
+def scale(raw: np.ndarray, altitude: float = 0) -> np.ndarray:
+    out = np.empty((len(raw), COLUMNS))
+    out[:, 0:3] = raw["attitude"] / ATTITUDE_SCALE
+    out[:, 3:6] = raw["targetAttitude"] / ATTITUDE_SCALE
+    out[:, 6:10] = (raw["engines"].astype(np.float64) - ENGINE_OFFSET) / ENGINE_OFFSET
+    out[:, 10] = altitude
+    out[:, 11] = raw["voltage"] // VOLTAGE_DIVIDER
+    out[:, 12] = raw["cycletime"]
+    out[:, 13] = raw["armed"] != 0
+    return out
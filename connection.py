@@ -1,31 +1,142 @@
+import os
+import asyncio
+import atexit
+import bisect
+import functools
+import math
+import queue
+import shutil
 import socket
-import select
 import struct
+import tempfile
 import threading
 from devices import Controls
-from PyQt5.QtCore import pyqtSignal
+from events import Event
 import time
 import numpy as np
+import codec
+from runningstats import RunningStats
+from flightlog import LogWriter
+from fanout import FanoutServer
+from collections import deque, namedtuple
 
 
-class Telemetry(object):  #
+class Snapshot(namedtuple("Snapshot", ["generation", "altitude", "raw"])):
+    # Immutable telemetry frame holding the wire values, scaled only when a reader asks
+    __slots__ = ()
+
+    @property
+    def armed(self):
+        return self.raw[1] != 0
+
+    @property
+    def cycletime(self):
+        return self.raw[2]
+
+    @property
+    def attitude(self):
+        raw = self.raw
+        return (raw[3] / codec.ATTITUDE_SCALE, raw[4] / codec.ATTITUDE_SCALE, raw[5] / codec.ATTITUDE_SCALE)
+
+    @property
+    def engines(self):
+        return tuple((x - codec.ENGINE_OFFSET) / codec.ENGINE_OFFSET for x in self.raw[6:10])
+
+    @property
+    def voltage(self):
+        return self.raw[10] // codec.VOLTAGE_DIVIDER
+
+    @property
+    def targetAttitude(self):
+        raw = self.raw
+        return (raw[11] / codec.ATTITUDE_SCALE, raw[12] / codec.ATTITUDE_SCALE, raw[13] / codec.ATTITUDE_SCALE)
+
+
+class Telemetry(object):
+    __slots__ = ("altitude", "_snapshot")
+
     def __init__(self) -> None:
-        self.engines = [0.0, 0.0, 0.0, 0.0]
-        self.attitude = [0.0, 0.0, 0.0]
-        self.targetAttitude = [0.0, 0.0, 0.0]
         self.altitude = 0
-        self.cycletime = 0
-        self.armed = False
-        self.voltage = 0
+        self._snapshot = Snapshot(0, 0, codec.IDLE)
+
+    def publish(self, raw: tuple) -> None:
+        # Single writer; replacing the reference is atomic, so readers never see half a frame and never wait
+        self._snapshot = Snapshot(self._snapshot.generation + 1, self.altitude, raw)
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    @property
+    def generation(self):
+        return self._snapshot.generation
+
+    @property
+    def armed(self):
+        return self._snapshot.armed
+
+    @property
+    def cycletime(self):
+        return self._snapshot.cycletime
+
+    @property
+    def attitude(self):
+        return self._snapshot.attitude
+
+    @property
+    def engines(self):
+        return self._snapshot.engines
+
+    @property
+    def voltage(self):
+        return self._snapshot.voltage
+
+    @property
+    def targetAttitude(self):
+        return self._snapshot.targetAttitude
 
     def getSize(self):
         return 11
 
 
+STATS_BATCH = 64
+
+
+class SegmentWriter(object):
+    # One thread moves full chunks to disk for every BlackBox, however many vehicles are recording
+    def __init__(self) -> None:
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, task) -> threading.Event:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, args=())
+                self.thread.daemon = True
+                self.thread.start()
+        done = threading.Event()
+        self.queue.put((task, done))
+        return done
+
+    def _run(self) -> None:
+        while True:
+            task, done = self.queue.get()
+            try:
+                task()
+            finally:
+                done.set()
+
+
+WRITER = SegmentWriter()
+
+
 class BlackBox(object):
-    def __init__(self, size: int = 10000) -> None:
+    def __init__(
+        self, size: int = 10000, directory: str = None, compact: bool = False, window: int = 500, logDirectory=None
+    ) -> None:
         self.recording = False
         self.data_length = size
+        self.compact = compact
         self.index = 0
         self.labels = [
             "Roll",
@@ -43,234 +154,862 @@ class BlackBox(object):
             "CycleTime",
             "Armed",
         ]
-        self.storage = np.zeros((self.data_length, len(self.labels)))
-        self.timestamp = np.zeros((self.data_length, 1))
+        # Each segment holds the labels columns followed by the timestamp column
+        self.width = len(self.labels) + 1
+        self.stats = RunningStats(len(self.labels), window)
+        self._folded = 0
+        self._statsLock = threading.Lock()
+        self.directory = directory
+        self.logDirectory = logDirectory
+        self.logWriter = None
+        self.segments = []
+        self._session = 0
+        self._active = None
+        self._fill = 0
+        self._spare = self._allocate()
 
     def start_recording(self):
+        if self.logWriter is not None:
+            self.logWriter.stop()
+            self.logWriter = None
+        # Tasks run in order, so once our refill is done every store queued by this box has finished too
+        WRITER.put(self._clearSegmentFiles)
+        WRITER.put(self._refill).wait()
+        self.segments = []
+        self.index = 0
+        self._session += 1
+        with self._statsLock:
+            self.stats.reset()
+            self._folded = 0
+        self._rollover()
         self.startTime = time.time()
         self.recording = True
-        self.index = 0
+        if self.logDirectory is not None:
+            os.makedirs(self.logDirectory, exist_ok=True)
+            stamp = time.strftime("flight-%Y%m%d-%H%M%S", time.localtime(self.startTime))
+            # Vehicles sharing the directory or a quick restart start within the same second, the number keeps
+            # every log apart and LogWriter refuses to replace an existing file
+            number = 1
+            while self.logWriter is None:
+                try:
+                    path = os.path.join(self.logDirectory, "{}-{:02d}.gslog".format(stamp, number))
+                    self.logWriter = LogWriter(self, path)
+                except FileExistsError:
+                    number += 1
+            self.logWriter.start()
 
     def stop_recording(self):
         self.recording = False
+        if self.logWriter is not None:
+            self.logWriter.stop()
+            self.logWriter = None
 
     def record(self, telemetry: Telemetry):
         if not self.recording:
             return
-        if self.index >= self.data_length:
-            self.recording = False
+        frame = telemetry.snapshot()
+        if self.compact:
+            self._active[self._fill] = codec.quantize(frame, time.time() - self.startTime)
+            self._advance(1)
+            return
+        row = self._active[self._fill]
+        row[0:3] = frame.attitude
+        row[3:6] = frame.targetAttitude
+        row[6:10] = frame.engines
+        row[10] = frame.altitude
+        row[11] = frame.voltage
+        row[12] = frame.cycletime
+        row[13] = frame.armed
+        row[14] = time.time() - self.startTime
+        self._advance(1)
+
+    def recordFrames(self, raw: np.ndarray, altitude: float = 0, arrivals: np.ndarray = None):
+        # arrivals holds the time.time() each frame was read, frames without one are stamped now
+        if not self.recording:
+            return
+        if arrivals is None:
+            timestamps = np.full(len(raw), time.time() - self.startTime)
+        else:
+            timestamps = np.asarray(arrivals, dtype=np.float64) - self.startTime
+        if not self.compact:
+            raw = codec.scale(raw, altitude)
+        offset = 0
+        while offset < len(raw):
+            count = min(len(raw) - offset, self.data_length - self._fill)
+            block = self._active[self._fill : self._fill + count]
+            frames = raw[offset : offset + count]
+            if self.compact:
+                for name in codec.DTYPE.names[1:]:
+                    block[name] = frames[name]
+                block["altitude"] = altitude
+                block["timestamp"] = timestamps[offset : offset + count]
+            else:
+                block[:, :14] = frames
+                block[:, 14] = timestamps[offset : offset + count]
+            offset += count
+            self._advance(count)
+
+    def _advance(self, count: int):
+        self._fill += count
+        self.index += count
+        if self._fill >= self.data_length:
+            WRITER.put(functools.partial(self._store, self._session, len(self.segments) - 1, self._active))
+            self._rollover()
+        if self.index - self._folded >= STATS_BATCH:
+            self._foldStats()
+
+    def _rollover(self):
+        self._active = self._spare if self._spare is not None else self._allocate()
+        self._spare = None
+        self._fill = 0
+        self.segments.append(self._active)
+
+    def _allocate(self) -> np.ndarray:
+        # Touch every page here so the telemetry thread never takes the page faults
+        if self.compact:
+            chunk = np.empty(self.data_length, dtype=codec.RECORD_DTYPE)
+        else:
+            chunk = np.empty((self.data_length, self.width))
+        chunk.fill(0)
+        return chunk
+
+    def _store(self, session: int, number: int, chunk: np.ndarray):
+        segment = np.lib.format.open_memmap(
+            self._segmentPath(session, number), mode="w+", dtype=chunk.dtype, shape=chunk.shape
+        )
+        segment[:] = chunk
+        segment.flush()
+        if session == self._session and self.segments[number] is chunk:
+            self.segments[number] = segment
+        self._refill()
+
+    def _refill(self):
+        if self._spare is None:
+            self._spare = self._allocate()
+
+    def _segmentPath(self, session: int, number: int) -> str:
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="blackbox-")
+            atexit.register(shutil.rmtree, self.directory, True)
+        return os.path.join(self.directory, "segment-{:03d}-{:05d}.npy".format(session, number))
+
+    def _clearSegmentFiles(self):
+        if self.directory is None:
             return
-        data = []
-        data.extend(telemetry.attitude)
-        data.extend(telemetry.targetAttitude)
-        data.extend(telemetry.engines)
-        data.append(telemetry.altitude)
-        data.append(telemetry.voltage)
-        data.append(telemetry.cycletime)
-        data.append(telemetry.armed)
-        self.storage[self.index, :] = np.array(data)
-        self.timestamp[self.index] = time.time() - self.startTime
-        self.index += 1
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name.endswith(".npy"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Still mapped by a reader on platforms that lock mapped files
+                    pass
+
+    def chunks(self, start: int = 0, stop: int = None):
+        if stop is None:
+            stop = self.index
+        segments = list(self.segments)
+        start = max(start, 0)
+        while start < stop:
+            number = start // self.data_length
+            if number >= len(segments):
+                return
+            offset = number * self.data_length
+            end = min(stop, offset + self.data_length)
+            yield segments[number][start - offset : end - offset]
+            start = end
+
+    def _chunkRows(self, chunk: np.ndarray) -> np.ndarray:
+        if not self.compact:
+            return chunk[:, :14]
+        return codec.scale(chunk, chunk["altitude"])
+
+    def _foldStats(self):
+        # Statistics are folded from the stored rows in blocks, per row numpy updates would cost more than the decode
+        with self._statsLock:
+            index = self.index
+            for chunk in self.chunks(self._folded, index):
+                self.stats.extend(self._chunkRows(chunk))
+            self._folded = index
+
+    def statistics(self, rolling: bool = False) -> dict:
+        self._foldStats()
+        return self.stats.rolling() if rolling else self.stats.total()
+
+    def limits(self, columns: list, rolling: bool = False) -> tuple:
+        self._foldStats()
+        return self.stats.limits(columns, rolling)
+
+    def _chunkColumn(self, chunk: np.ndarray, i: int) -> np.ndarray:
+        if not self.compact:
+            return chunk[:, i]
+        if i == 14:
+            return chunk["timestamp"].astype(np.float64)
+        return codec.scaleColumn(chunk, i)
+
+    def column(self, i: int, start: int = 0, stop: int = None) -> np.ndarray:
+        # A view while the range stays inside one float segment, a copy once it crosses a segment boundary
+        if stop is None:
+            stop = self.index
+        parts = [self._chunkColumn(chunk, i) for chunk in self.chunks(start, stop)]
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 0:
+            return np.zeros(0)
+        return np.concatenate(parts)
+
+    def timestamps(self, start: int = 0, stop: int = None) -> np.ndarray:
+        return self.column(14, start, stop)
+
+
+HANDSHAKE = 1
+PARAMETER_READ = 2
+PARAMETER_WRITE = 3
+TELEMETRY_ENABLE = 4
+CONTROL = 20
+
+
+MESSAGE_NAMES = {
+    HANDSHAKE: "Handshake",
+    PARAMETER_READ: "Parameter read",
+    PARAMETER_WRITE: "Parameter write",
+    TELEMETRY_ENABLE: "Telemetry enable",
+    codec.TELEMETRY_TYPE: "Telemetry",
+    CONTROL: "Control",
+}
+
+# type, arm, pitch, roll, yaw, thrust
+CONTROL_FRAME = struct.Struct("<BBhhhh")
+
+# Colours sent with configSignal for the outcome of a parameter write
+WRITTEN = "#00a000"
+FAILED = "#a00000"
+
+
+class SampleStats(object):
+    def __init__(self, size: int = 1000) -> None:
+        self.samples = np.zeros(size)
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        samples = self.samples[: min(self.count, len(self.samples))].copy()
+        if len(samples) == 0:
+            return dict(count=0)
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return dict(
+            count=self.count,
+            mean=float(np.mean(samples)),
+            std=float(np.std(samples)),
+            min=float(np.min(samples)),
+            max=float(np.max(samples)),
+            p50=float(p50),
+            p95=float(p95),
+            p99=float(p99),
+        )
+
+
+class JitterStats(SampleStats):
+    def reset(self) -> None:
+        super().reset()
+        self.last = None
+
+    def tick(self, now: float) -> None:
+        if self.last is not None:
+            self.add(now - self.last)
+        self.last = now
+
+
+class MessageStats(object):
+    # Inter-arrival histogram bin edges in seconds
+    EDGES = np.geomspace(0.001, 10.0, 21)
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.received = 0
+        self.sent = 0
+        self.requests = 0
+        self.last = None
+        self.arrivals = deque()
+        self.histogram = np.zeros(len(MessageStats.EDGES) + 1, dtype=np.int64)
+        self.gaps = SampleStats(256)
+        self.rtt = SampleStats(256)
+
+    def receive(self, now: float) -> None:
+        self.received += 1
+        self.arrivals.append(now)
+        while self.arrivals[0] < now - self.window:
+            self.arrivals.popleft()
+        if self.last is not None:
+            gap = now - self.last
+            self.histogram[bisect.bisect(MessageStats.EDGES, gap)] += 1
+            self.gaps.add(gap)
+        self.last = now
+
+    def snapshot(self, now: float) -> dict:
+        while len(self.arrivals) > 0 and self.arrivals[0] < now - self.window:
+            self.arrivals.popleft()
+        span = min(self.window, now - self.arrivals[0]) if len(self.arrivals) > 1 else 0
+        if self.requests > 0:
+            # Request/response: every request without a reply counts as lost
+            loss = max(0.0, 1.0 - self.received / self.requests)
+        else:
+            # Streams carry no sequence numbers: the median gap is the send period as long as
+            # less than half of the frames are lost, so the recent gaps tell how many were expected
+            gaps = self.gaps.samples[: min(self.gaps.count, len(self.gaps.samples))]
+            median = np.median(gaps) if len(gaps) > 0 else 0.0
+            loss = max(0.0, 1.0 - len(gaps) * median / np.sum(gaps)) if median > 0 else 0.0
+        return dict(
+            received=self.received,
+            sent=self.sent,
+            requests=self.requests,
+            rate=(len(self.arrivals) - 1) / span if span > 0 else 0.0,
+            loss=loss,
+            age=now - self.last if self.last is not None else None,
+            histogram=dict(edges=MessageStats.EDGES.tolist(), counts=self.histogram.tolist()),
+            gaps=self.gaps.snapshot(),
+            rtt=self.rtt.snapshot(),
+        )
+
+
+class LinkStats(object):
+    def __init__(self, window: float = 5.0) -> None:
+        self.window = window
+        self.types = dict()
+
+    def _get(self, mtype: int) -> MessageStats:
+        if mtype not in self.types:
+            self.types[mtype] = MessageStats(self.window)
+        return self.types[mtype]
+
+    def received(self, mtype: int, now: float = None) -> None:
+        self._get(mtype).receive(time.monotonic() if now is None else now)
+
+    def sent(self, mtype: int, request: bool = True) -> None:
+        stats = self._get(mtype)
+        stats.sent += 1
+        if request:
+            stats.requests += 1
 
+    def roundTrip(self, mtype: int, rtt: float) -> None:
+        self._get(mtype).rtt.add(rtt)
 
-class Timeout(object):
-    def __init__(self, time) -> None:
-        self._time = time
-        self.timer = time
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {MESSAGE_NAMES.get(mtype, str(mtype)): stats.snapshot(now) for mtype, stats in self.types.items()}
 
-    def reset(self):
-        self.timer = self._time
 
-    def tick(self):
-        self.timer -= 1
-        return self.timer > 0
+class Endpoint(object):
+    def __init__(self, telemetryCallback, stats: LinkStats = None) -> None:
+        self.protocol = None
+        self.telemetryCallback = telemetryCallback
+        self.stats = stats if stats is not None else LinkStats()
+        # Telemetry datagrams of the current receive batch and the time.time() each was read
+        self.telemetry = []
+        self.arrivals = []
+        # (message type, id) -> (future, accept)
+        self.pending = dict()
+
+    def sendto(self, data: bytes, addr) -> None:
+        self.protocol.sendto(data, addr)
+
+    def receive(self, data: bytes, addr, arrival: float = None) -> None:
+        mtype = data[0]
+        self.stats.received(mtype)
+        if mtype == codec.TELEMETRY_TYPE:
+            # Malformed frames are dropped here so every queued datagram decodes and keeps its arrival time
+            if len(data) != codec.FRAME.size:
+                return
+            if len(self.telemetry) == 0:
+                self.protocol.batched.append(self)
+            self.telemetry.append(data)
+            self.arrivals.append(time.time() if arrival is None else arrival)
+            return
+        key = (mtype, data[1] if mtype != HANDSHAKE and len(data) > 1 else None)
+        waiter = self.pending.get(key)
+        if waiter is not None and not waiter[0].done() and waiter[1](data):
+            waiter[0].set_result(data)
+
+    def expect(self, key: tuple, accept=None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = (future, accept if accept is not None else lambda data: True)
+        return future
+
+    def release(self, key: tuple, future: asyncio.Future) -> None:
+        if self.pending.get(key, (None,))[0] is future:
+            del self.pending[key]
+
+    def flush(self) -> None:
+        datagrams, self.telemetry = self.telemetry, []
+        arrivals, self.arrivals = self.arrivals, []
+        self.telemetryCallback(datagrams, arrivals)
+
+
+def openSocket(local: tuple = ("0.0.0.0", 0)) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.bind(local)
+    return sock
+
+
+class TowerProtocol(object):
+    # Reads and sends on the socket directly rather than through a datagram transport. A transport reads one
+    # datagram per loop iteration, and on the proactor loop it already has the next read posted while the
+    # previous datagram is handled, so draining beside it would reorder frames
+    def __init__(self, sock: socket.socket, default: Endpoint = None, limit: int = 256) -> None:
+        self.socket = sock
+        self.limit = limit
+        self.batched = []
+        # Source address -> endpoint, datagrams from unknown addresses go to the default endpoint
+        self.endpoints = dict()
+        self.default = default
+        if default is not None:
+            default.protocol = self
+
+    def start(self) -> None:
+        # Needs a selector loop, see Tower and Fleet
+        asyncio.get_running_loop().add_reader(self.socket.fileno(), self._readReady)
+
+    def sendto(self, data: bytes, addr) -> None:
+        try:
+            self.socket.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            # A full send buffer drops the datagram like the link would
+            pass
+        except OSError as exc:
+            self.error_received(exc)
+
+    def error_received(self, exc) -> None:
+        # ICMP errors from an unreachable copter surface as request timeouts
+        pass
+
+    def attach(self, addr: tuple, endpoint: Endpoint) -> None:
+        endpoint.protocol = self
+        self.endpoints[addr] = endpoint
+
+    def detach(self, addr: tuple) -> None:
+        self.endpoints.pop(addr, None)
+
+    def _route(self, data: bytes, addr, arrival: float) -> None:
+        if len(data) == 0:
+            return
+        endpoint = self.endpoints.get(addr, self.default)
+        if endpoint is not None:
+            endpoint.receive(data, addr, arrival)
+
+    def _readReady(self) -> None:
+        # Drains the backlog in arrival order, the batch is handed over once it is read
+        for _ in range(self.limit):
+            try:
+                data, addr = self.socket.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self.error_received(exc)
+                continue
+            self._route(data, addr, time.time())
+        batched, self.batched = self.batched, []
+        for endpoint in batched:
+            endpoint.flush()
+
+
+class RoundTripEstimator(object):
+    def __init__(self, initial: float = 1.0, minimum: float = 0.05, maximum: float = 4.0) -> None:
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+
+    def update(self, sample: float) -> None:
+        # RFC 6298 smoothing
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.minimum), self.maximum)
+
+    def timeout(self, attempt: int) -> float:
+        return min(self.rto * 2**attempt, self.maximum)
+
+
+class Transactions(object):
+    def __init__(self, endpoint: Endpoint, window: int = 8, tries: int = 4) -> None:
+        self.endpoint = endpoint
+        self.window = window
+        self.tries = tries
+        self.rtt = RoundTripEstimator()
+
+    async def request(self, addr, message: bytes, key: tuple, accept=None) -> bytes:
+        # Retransmissions keep the same future, so a late ack of an earlier copy still completes it
+        future = self.endpoint.expect(key, accept)
+        try:
+            for attempt in range(self.tries):
+                sent = time.monotonic()
+                self.endpoint.sendto(message, addr)
+                self.endpoint.stats.sent(key[0])
+                try:
+                    data = await asyncio.wait_for(asyncio.shield(future), self.rtt.timeout(attempt))
+                except asyncio.TimeoutError:
+                    continue
+                if attempt == 0:
+                    self.rtt.update(time.monotonic() - sent)
+                    self.endpoint.stats.roundTrip(key[0], time.monotonic() - sent)
+                return data
+            raise Exception("Number of tries exceeded!")
+        finally:
+            self.endpoint.release(key, future)
+
+    async def run(self, addr, items: list, progress=None) -> list:
+        # items are (message, key, accept) tuples, results are the replies or the raised exceptions
+        semaphore = asyncio.Semaphore(self.window)
+        done = 0
+
+        async def transact(item):
+            nonlocal done
+            async with semaphore:
+                try:
+                    result = await self.request(addr, *item)
+                except Exception as e:
+                    result = e
+            done += 1
+            if progress is not None:
+                progress(done, len(items))
+            return result
+
+        return await asyncio.gather(*[transact(item) for item in items])
 
 
 class Tower:
     def __init__(
-        self, target: str = "192.168.4.1", port: int = 4321, signalRate: float = 0.02, numberOfTries: int = 4
+        self,
+        target: str = "192.168.4.1",
+        port: int = 4321,
+        signalRate: float = 0.02,
+        numberOfTries: int = 4,
+        fleet: "Fleet" = None,
+        controlInterval: float = 0.005,
     ) -> None:
         self.target = target
         self.port = port
-        self.socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.socket.setblocking(True)
-        # self.socket.bind(("", port))
         self.numberOfTries = numberOfTries
         self.connected = False
         self.controlled = False
+        # Keepalive period when the sticks are still, changes are sent at most every controlInterval
         self.signalRate = signalRate
-        self.socket_blocked = False
-        self.telemetryThread = None
+        self.controlInterval = controlInterval
+        self.window = 8
+        self.telemetryTimeout = 10.0
+        self.lastTelemetry = 0.0
+        self.watchdog = None
+        self.controlJitter = JitterStats()
+        self.inputLatency = SampleStats()
+        self._controlChanged = asyncio.Event()
+        self._sentTimestamp = 0.0
+        self._controlBuffer = bytearray(CONTROL_FRAME.size)
+        self.endpoint = Endpoint(self._onTelemetry)
+        self.fanout = None
+        self.fleet = fleet
+        if fleet is None:
+            # add_reader is only there on selector loops, Windows defaults to the proactor loop
+            self.loop = asyncio.SelectorEventLoop()
+            self.loopThread = threading.Thread(target=self.loop.run_forever, args=())
+            self.loopThread.daemon = True
+            self.loopThread.start()
+            self.protocol = self._call(self._open())
+        else:
+            # Shares the socket and loop of the fleet, replies are routed here by source address
+            self.loop = fleet.loop
+            self.loopThread = fleet.loopThread
+            self.protocol = fleet.protocol
+            self.protocol.attach((self.target, self.port), self.endpoint)
+        self.transactions = Transactions(self.endpoint, self.window, self.numberOfTries)
 
     def connectSignals(
         self,
-        configSignal: pyqtSignal,
-        addItemSignal: pyqtSignal,
-        messageSignal: pyqtSignal,
+        configSignal: Event,
+        parameterSignal: Event,
+        messageSignal: Event,
+        progressSignal: Event = None,
     ) -> None:
-        self.addItemSignal = addItemSignal
+        self.parameterSignal = parameterSignal
         self.configSignal = configSignal
         self.messageSignal = messageSignal
+        self.progressSignal = progressSignal
 
     def connectClasses(self, telemetry: Telemetry, blackbox: BlackBox, controls: Controls):
         self.telemetry = telemetry
         self.controls = controls
         self.blackbox = blackbox
+        controls.changed.connect(self._onControls)
 
-    def getHandshake(self, target: str) -> None:
-        self.socket_blocked = True
-        self.target = target
+    def _onControls(self) -> None:
+        # Called from the gamepad thread
+        if self.controlled:
+            self.loop.call_soon_threadsafe(self._controlChanged.set)
 
-        error = Exception("Number of tries exceeded!")
-        mtype = bytearray(struct.pack("B", 1))
-        for _ in range(self.numberOfTries):
-            try:
-                self.socket.sendto(mtype, (self.target, self.port))
-                if select.select([self.socket], [], [], 1.0)[0]:
-                    dataPair = self.socket.recvfrom(255)
-                    # print("Handshake", dataPair)
-                    data = dataPair[0]
-                    if mtype == bytearray(data[:1]) and len(data) - 2 == int.from_bytes(
-                        bytes=data[1:2], byteorder="big", signed=False
-                    ):
-                        _parameterIndex = [x for x in data[2:]]
-                        break
-            except Exception as e:
-                error = e
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
 
-        else:
-            self.messageSignal.emit(str(error))
-            return
+    def _spawn(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
 
-        mtype = bytearray(struct.pack("B", 2))
-        _config = dict()
-        for id in _parameterIndex:
-            for _ in range(self.numberOfTries):
-                try:
-                    bid = bytearray(struct.pack("B", int(id)))
-                    self.socket.sendto(mtype + bid, (self.target, self.port))
-                    if select.select([self.socket], [], [], 1.0)[0]:
-                        dataPair = self.socket.recvfrom(255)
-                        data = dataPair[0]
-                        # print("Defaults:", data)
-                        if bytearray(data[:2]) == mtype + bid:
-                            _config[id] = struct.unpack("f", data[2:])[0]
-                            break
-                except Exception as e:
-                    error = e
-            else:
-                self.messageSignal.emit(str(error))
-                return
+    async def _open(self) -> TowerProtocol:
+        protocol = TowerProtocol(openSocket(), self.endpoint)
+        protocol.start()
+        return protocol
 
-        mtype = bytearray(struct.pack("B", 4))
-        for _ in range(self.numberOfTries):
-            try:
-                bid = bytearray(struct.pack("B", int(1)))
-                self.socket.sendto(mtype + bid, (self.target, self.port))
-                if select.select([self.socket], [], [], 1.0)[0]:
-                    dataPair = self.socket.recvfrom(255)
-                    data = dataPair[0]
-                    # print("Telemetry:", data)
-                    if bytearray(data[:2]) == mtype + bid:
-                        break
-            except Exception as e:
-                error = e
-        else:
-            self.messageSignal.emit(str(error))
+    def _progress(self, task: str):
+        if self.progressSignal is None:
+            return None
+        return lambda done, total: self.progressSignal.emit(task, done, total)
+
+    def connect(self, target: str) -> None:
+        self._spawn(self._connect(target))
+
+    async def _connect(self, target: str) -> None:
+        await self._handshake(target)
+        self.runTelemetry()
+        self.runControl()
+
+    def getHandshake(self, target: str) -> None:
+        self._call(self._handshake(target))
+
+    def _retarget(self, target: str) -> None:
+        if self.fleet is not None:
+            self.protocol.detach((self.target, self.port))
+            self.protocol.attach((target, self.port), self.endpoint)
+        self.target = target
+
+    async def _handshake(self, target: str) -> None:
+        self._retarget(target)
+        addr = (self.target, self.port)
+        try:
+            data = await self.transactions.request(
+                addr,
+                bytes([HANDSHAKE]),
+                (HANDSHAKE, None),
+                accept=lambda data: len(data) >= 2 and len(data) - 2 == data[1],
+            )
+            _parameterIndex = list(data[2:])
+            replies = await self.transactions.run(
+                addr,
+                [
+                    (bytes([PARAMETER_READ, id]), (PARAMETER_READ, id), lambda data: len(data) == 6)
+                    for id in _parameterIndex
+                ],
+                self._progress("Reading parameters"),
+            )
+            for reply in replies:
+                if isinstance(reply, Exception):
+                    raise reply
+            await self.transactions.request(addr, bytes([TELEMETRY_ENABLE, 1]), (TELEMETRY_ENABLE, 1))
+        except Exception as e:
+            self.messageSignal.emit(str(e))
             return
 
-        for id, value in _config.items():
-            group = GROUPS[int(id / 10) + 1]
-            child = NAMES[id]
-            self.addItemSignal.emit(group, child, value, id)
+        parameters = []
+        for id, data in zip(_parameterIndex, replies):
+            value = struct.unpack("f", data[2:])[0]
+            parameters.append((GROUPS[int(id / 10) + 1], NAMES[id], value, id))
+        # One signal for the whole table, the view rebuilds once instead of per parameter
+        self.parameterSignal.emit(parameters)
+        self.lastTelemetry = time.monotonic()
         self.connected = True
-        self.socket_blocked = False
 
     def updateConfig(self, config: dict) -> None:
         if not self.connected or self.controls.tr > 0.8:
             return
-        self.socket_blocked = True
-        _toDelete = []
-        mtype = bytearray(struct.pack("B", 3))
-        for loc, value in config.items():
-            for _ in range(self.numberOfTries):
-                try:
-                    bid = bytearray(struct.pack("B", int(value[0])))
-                    bvalue = bytearray(struct.pack("f", float(value[1])))
-                    self.socket.sendto(mtype + bid + bvalue, (self.target, self.port))
-                    if select.select([self.socket], [], [], 2.0)[0]:
-                        dataPair = self.socket.recvfrom(1024)
-                        if dataPair[0] == mtype + bid + bvalue:
-                            _toDelete.append(loc)
-                            self.configSignal.emit(loc, "#00a000")
-                            break
-                except Exception as e:
-                    print(e)
-            else:
-                self.configSignal.emit(loc, "#a00000")
-        for loc in _toDelete:
-            del config[loc]
-        self.socket_blocked = False
+        self._spawn(self._updateConfig(config))
+
+    async def _updateConfig(self, config: dict) -> None:
+        addr = (self.target, self.port)
+        ids = sorted(config)
+        items = []
+        for id in ids:
+            message = bytes([PARAMETER_WRITE, id]) + struct.pack("f", config[id])
+            items.append((message, (PARAMETER_WRITE, id), lambda data, message=message: data == message))
+        replies = await self.transactions.run(addr, items, self._progress("Writing parameters"))
+        for id, reply in zip(ids, replies):
+            self.configSignal.emit(id, FAILED if isinstance(reply, Exception) else WRITTEN)
+
+    def _onTelemetry(self, datagrams: list, arrivals: list) -> None:
+        if not self.connected:
+            return
+        raw = codec.decodeBatch(datagrams)
+        if len(raw) == 0:
+            return
+        arrivals = np.array(arrivals)
+        # The whole batch is recorded, the instruments only need its newest frame
+        self.blackbox.recordFrames(raw, self.telemetry.altitude, arrivals)
+        self.telemetry.publish(codec.unpack(raw[-1:].tobytes()))
+        if self.fanout is not None:
+            self.fanout.publishFrames(raw, arrivals)
+        self.lastTelemetry = time.monotonic()
+
+    def startFanout(self, port: int = 4322, host: str = "127.0.0.1") -> FanoutServer:
+        # Local consumers get every frame without a second session to the copter
+        if self.fanout is None:
+            self.fanout = self._call(FanoutServer().start(host, port))
+        return self.fanout
 
     def runTelemetry(self) -> None:
-        if self.telemetryThread != None:
+        if self.watchdog is not None:
             return
-        self.telemetryThread = threading.Thread(target=self._runTelemetry, args=())
-        self.telemetryThread.daemon = True
-        self.telemetryThread.start()
-
-    def _runTelemetry(self) -> None:
-        mtype = bytearray(struct.pack("B", 10))
-        timer = Timeout(10)
-        while self.connected and timer.tick():
-            if select.select([self.socket], [], [], 1.0)[0] and not self.socket_blocked:
-                data = self.socket.recvfrom(1024)[0]
-                if mtype == bytearray(data[:1]):
-                    self.telemetry.armed = struct.unpack("B", data[1:2])[0] != 0
-                    self.telemetry.cycletime = struct.unpack("H", data[2:4])[0]
-                    # Attitude
-                    self.telemetry.attitude[0] = struct.unpack("h", data[4:6])[0] / 160.0
-                    self.telemetry.attitude[1] = struct.unpack("h", data[6:8])[0] / 160.0
-                    self.telemetry.attitude[2] = struct.unpack("h", data[8:10])[0] / 160.0
-                    # Engines
-                    self.telemetry.engines[0] = (struct.unpack("H", data[10:12])[0] - 3277) / 3277
-                    self.telemetry.engines[1] = (struct.unpack("H", data[12:14])[0] - 3277) / 3277
-                    self.telemetry.engines[2] = (struct.unpack("H", data[14:16])[0] - 3277) / 3277
-                    self.telemetry.engines[3] = (struct.unpack("H", data[16:18])[0] - 3277) / 3277
-                    # Stuff
-                    self.telemetry.voltage = int(struct.unpack("H", data[18:20])[0] / 3)
-                    # Attitude
-                    self.telemetry.targetAttitude[0] = struct.unpack("h", data[20:22])[0] / 160.0
-                    self.telemetry.targetAttitude[1] = struct.unpack("h", data[22:24])[0] / 160.0
-                    self.telemetry.targetAttitude[2] = struct.unpack("h", data[24:26])[0] / 160.0
-                    self.blackbox.record(self.telemetry)
-                    timer.reset()
-            elif self.socket_blocked:
-                timer.reset()
+        self.watchdog = self._spawn(self._watchTelemetry())
+
+    async def _watchTelemetry(self) -> None:
+        while self.connected:
+            remaining = self.lastTelemetry + self.telemetryTimeout - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
         self.messageSignal.emit("Copter Disconnected!")
         self.connected = False
+        self.watchdog = None
 
     def runControl(self) -> None:
         if self.controlled:
             return
-        self.controlThread = threading.Thread(target=self._runControl, args=())
-        self.controlThread.daemon = True
         self.controlled = True
-        self.controlThread.start()
+        self._spawn(self._runControl())
+
+    def getControlJitter(self) -> dict:
+        return self.controlJitter.snapshot()
+
+    def getInputLatency(self) -> dict:
+        return self.inputLatency.snapshot()
 
-    def _runControl(self) -> None:
-        mtype = bytearray(struct.pack("B", 20))
+    def getLinkStats(self) -> dict:
+        # Taken on the transport loop so the counters are not read mid-update
+        return self._call(self._linkStats())
+
+    async def _linkStats(self) -> dict:
+        stats = self.endpoint.stats.snapshot()
+        if "Control" in stats:
+            jitter = self.controlJitter.snapshot()
+            stats["Control"]["jitter"] = jitter
+            if jitter["count"] > 0:
+                stats["Control"]["rate"] = 1.0 / jitter["mean"]
+            stats["Control"]["inputLatency"] = self.inputLatency.snapshot()
+        return stats
+
+    async def _runControl(self) -> None:
+        period = self.signalRate
+        deadline = self.loop.time()
+        sent = -math.inf
+        self.controlJitter.reset()
+        self.inputLatency.reset()
         while self.connected and self.controlled:
-            barm = bytearray(struct.pack("B", int(self.controls.tr > 0.8)))  # arm
-            bptch = bytearray(struct.pack("h", int(self.controls.ry * 32000)))
-            brll = bytearray(struct.pack("h", int(self.controls.rx * 32000)))
-            byaw = bytearray(struct.pack("h", int(-self.controls.lx * 32000)))
-            bthr = bytearray(struct.pack("h", int(-self.controls.ly * 32000)))
-            if not self.socket_blocked:
-                self.socket.sendto(mtype + barm + bptch + brll + byaw + bthr, (self.target, self.port))
-            time.sleep(self.signalRate)
+            now = self.loop.time()
+            if deadline > now and not self._controlChanged.is_set():
+                try:
+                    await asyncio.wait_for(self._controlChanged.wait(), deadline - now)
+                except asyncio.TimeoutError:
+                    pass
+            self._controlChanged.clear()
+            now = self.loop.time()
+            if now < sent + self.controlInterval:
+                # Changes arriving faster than the cap are merged into the next frame
+                await asyncio.sleep(sent + self.controlInterval - now)
+                now = self.loop.time()
+            self._sendControl()
+            sent = now
+            if now < deadline:
+                # Sent for a change, the next keepalive is one full period later. Only unbroken runs of
+                # keepalives are timed so the jitter and rate keep describing the keepalive clock
+                self.controlJitter.last = None
+                deadline = now + period
+            else:
+                self.controlJitter.tick(now)
+                # Absolute deadlines keep the loop time out of the period, missed ticks are dropped
+                deadline += ((now - deadline) // period + 1) * period
         self.controlled = False
 
+    def _sendControl(self) -> None:
+        CONTROL_FRAME.pack_into(
+            self._controlBuffer,
+            0,
+            CONTROL,
+            int(self.controls.tr > 0.8),  # arm
+            int(self.controls.ry * 32000),
+            int(self.controls.rx * 32000),
+            int(-self.controls.lx * 32000),
+            int(-self.controls.ly * 32000),
+        )
+        self.protocol.sendto(self._controlBuffer, (self.target, self.port))
+        self.endpoint.stats.sent(CONTROL, False)
+        if self.controls.timestamp != self._sentTimestamp:
+            # First send of a new stick state, measured from the HID event time
+            self._sentTimestamp = self.controls.timestamp
+            self.inputLatency.add(time.time() - self.controls.timestamp)
+
+
+class Fleet(object):
+    def __init__(self, localPort: int = None) -> None:
+        self.localPort = localPort
+        self.vehicles = dict()
+        self.loop = asyncio.SelectorEventLoop()
+        self.loopThread = threading.Thread(target=self.loop.run_forever, args=())
+        self.loopThread.daemon = True
+        self.loopThread.start()
+        self.protocol = self._call(self._open())
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _open(self) -> TowerProtocol:
+        protocol = TowerProtocol(openSocket(("0.0.0.0", 0 if self.localPort is None else self.localPort)))
+        protocol.start()
+        return protocol
+
+    def add(
+        self,
+        target: str,
+        port: int = 4321,
+        telemetry: Telemetry = None,
+        blackbox: BlackBox = None,
+        controls: Controls = None,
+        signals: tuple = None,
+        **kwargs
+    ) -> Tower:
+        # Vehicles are keyed by the address their datagrams come from, so give targets as IP addresses
+        tower = Tower(target, port, fleet=self, **kwargs)
+        tower.connectSignals(*(signals if signals is not None else (Event(), Event(), Event(), Event())))
+        tower.connectClasses(
+            telemetry if telemetry is not None else Telemetry(),
+            blackbox if blackbox is not None else BlackBox(compact=True),
+            controls if controls is not None else Controls(),
+        )
+        self.vehicles[(target, port)] = tower
+        return tower
+
+    def remove(self, tower: Tower) -> None:
+        tower.connected = False
+        tower.controlled = False
+        self.loop.call_soon_threadsafe(self.protocol.detach, (tower.target, tower.port))
+        self.vehicles.pop((tower.target, tower.port), None)
+
+    def connectAll(self) -> None:
+        for tower in list(self.vehicles.values()):
+            tower.connect(tower.target)
+
+    def getLinkStats(self) -> dict:
+        return self._call(self._linkStats())
+
+    async def _linkStats(self) -> dict:
+        stats = dict()
+        for (target, port), tower in list(self.vehicles.items()):
+            stats["{}:{}".format(target, port)] = await tower._linkStats()
+        return stats
+
 
 GROUPS = dict()
 GROUPS[1] = "System"
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class MinMaxPyramid(object):
+    def __init__(self, timestamp: np.ndarray, values: np.ndarray) -> None:
+        self.timestamp = np.asarray(timestamp, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        # Level k holds the min and max of every 2**k consecutive samples, level 0 is the raw data
+        self.levels = [(self.values, self.values)]
+        low, high = self.values, self.values
+        while len(low) > 1:
+            if len(low) % 2 == 1:
+                low = np.append(low, low[-1])
+                high = np.append(high, high[-1])
+            low = np.minimum(low[0::2], low[1::2])
+            high = np.maximum(high[0::2], high[1::2])
+            self.levels.append((low, high))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def extent(self) -> tuple:
+        if len(self) == 0:
+            return (0.0, 1.0)
+        return (self.timestamp[0], self.timestamp[-1])
+
+    def select(self, xmin: float, xmax: float, pixels: int) -> tuple:
+        start = max(int(np.searchsorted(self.timestamp, xmin, side="left")) - 1, 0)
+        stop = min(int(np.searchsorted(self.timestamp, xmax, side="right")) + 1, len(self))
+        pixels = max(int(pixels), 1)
+        level = 0
+        while level + 1 < len(self.levels) and (stop - start) >> level > pixels:
+            level += 1
+        if level == 0:
+            return self.timestamp[start:stop], self.values[start:stop]
+        low, high = self.levels[level]
+        first = start >> level
+        last = min(((stop - 1) >> level) + 1, len(low))
+        # Two points per bin at the bin start, min then max
+        x = np.repeat(self.timestamp[np.arange(first, last) << level], 2)
+        y = np.empty(2 * (last - first))
+        y[0::2] = low[first:last]
+        y[1::2] = high[first:last]
+        return x, y
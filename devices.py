@@ -1,10 +1,57 @@
 from inputs import get_gamepad
-import math
+import time
+import functools
 import threading
-from PyQt5.QtCore import pyqtSignal
+from array import array
+import numpy as np
+from events import Event
 
 DEADZONE = 0.008
 EXPO = 1.5
+# Controller state is published at most once per interval, the rest of the events are merged
+INTERVAL = 0.02
+
+
+@functools.lru_cache(maxsize=None)
+def responseCurve(bits: int, signed: bool, expo: float, deadzone: float) -> array:
+    # One packed double per raw state, axes with the same curve share the table
+    states = np.arange(2**bits) - (2 ** (bits - 1) if signed else 0)
+    value = states / 2 ** (bits - 1 if signed else bits)
+    magnitude = np.clip((np.abs(value) - deadzone) / (1 - deadzone), 0, None) ** expo
+    return array("d", (np.sign(value) * magnitude).tobytes())
+
+
+class Axis(object):
+    def __init__(
+        self,
+        attribute: str,
+        bits: int = 16,
+        signed: bool = True,
+        invert: bool = False,
+        expo: float = EXPO,
+        deadzone: float = DEADZONE,
+    ) -> None:
+        self.attribute = attribute
+        self.offset = 2 ** (bits - 1) if signed else 0
+        # The curve is odd, so an inverted axis is the negated output of the shared table
+        self.sign = -1.0 if invert else 1.0
+        self.table = responseCurve(bits, signed, float(expo), float(deadzone))
+
+    def __call__(self, state: int) -> float:
+        index = state + self.offset
+        if 0 <= index < len(self.table):
+            return self.sign * self.table[index]
+        return self.sign * self.table[0 if index < 0 else -1]
+
+
+def defaultAxes() -> dict:
+    return {
+        "ABS_X": Axis("lx"),
+        "ABS_Y": Axis("ly", invert=True),
+        "ABS_RX": Axis("rx"),
+        "ABS_RY": Axis("ry", invert=True),
+        "ABS_RZ": Axis("tr", bits=8, signed=False, expo=1.0),
+    }
 
 
 class Controls(object):
@@ -15,18 +62,24 @@ class Controls(object):
     tr = 0
 
     def __init__(self) -> None:
-        pass
+        # Wall clock time of the input event behind the current state
+        self.timestamp = 0.0
+        self.changed = Event()
 
 
 class XboxController(object):
-    MAX_JOY_VAL = math.pow(2, 15)
-    MAX_TRIG_VAL = math.pow(2, 8)
-
-    def __init__(self, controls: Controls, frameskip: int) -> None:
+    def __init__(self, controls: Controls, frameskip: int, axes: dict = None, interval: float = INTERVAL) -> None:
         self.controls = controls
         self.frameskip = frameskip
+        self.interval = interval * frameskip
+        self.axes = defaultAxes()
+        self.axes.update(axes or dict())
+        self.dirty = False
+        self.condition = threading.Condition()
+        self.events = 0
+        self.updates = 0
 
-    def connectSignals(self, controlSignal: pyqtSignal, messageSignal: pyqtSignal) -> None:
+    def connectSignals(self, controlSignal: Event, messageSignal: Event) -> None:
         self.controlSignal = controlSignal
         self.messageSignal = messageSignal
 
@@ -34,58 +87,52 @@ class XboxController(object):
         self.telemetryThread = threading.Thread(target=self._connect, args=())
         self.telemetryThread.daemon = True
         self.telemetryThread.start()
+        self.flushThread = threading.Thread(target=self._flush, args=())
+        self.flushThread.daemon = True
+        self.flushThread.start()
+
+    def feed(self, events: list) -> None:
+        # One state update per read, only the latest event of each axis counts
+        latest = dict()
+        for event in events:
+            if event.code in self.axes:
+                latest[event.code] = event
+        if len(latest) == 0:
+            return
+        self.events += len(latest)
+        timestamp = None
+        for code, event in latest.items():
+            axis = self.axes[code]
+            value = axis(event.state)
+            # Noise inside the deadzone maps to the same value and must not wake anything
+            if value != getattr(self.controls, axis.attribute):
+                setattr(self.controls, axis.attribute, value)
+                timestamp = event.timestamp if timestamp is None else max(timestamp, event.timestamp)
+        if timestamp is None:
+            return
+        self.controls.timestamp = timestamp
+        # The control sender is woken right away, only the repaint is rate limited
+        self.controls.changed.emit()
+        with self.condition:
+            self.dirty = True
+            self.condition.notify()
 
     def _connect(self) -> None:
         while True:
-            for _ in range(self.frameskip):
-                try:
-                    events = get_gamepad()
-                except Exception as e:
-                    self.messageSignal.emit(str(e))
-                    break
-
-                for event in events:
-                    if event.code == "ABS_Y":
-                        value = -event.state / XboxController.MAX_JOY_VAL  # normalize between -1 and 1
-                        if abs(value) > DEADZONE:
-                            self.controls.ly = math.copysign(
-                                math.pow(abs((value - math.copysign(DEADZONE, value)) / (1 - DEADZONE)), EXPO), value
-                            )
-                        else:
-                            self.controls.ly = 0
-                    elif event.code == "ABS_X":
-                        value = event.state / XboxController.MAX_JOY_VAL  # normalize between -1 and 1
-                        if abs(value) > DEADZONE:
-                            self.controls.lx = math.copysign(
-                                math.pow(abs((value - math.copysign(DEADZONE, value)) / (1 - DEADZONE)), EXPO), value
-                            )
-                        else:
-                            self.controls.lx = 0
-                    elif event.code == "ABS_RY":
-                        value = -event.state / XboxController.MAX_JOY_VAL  # normalize between -1 and 1
-                        if abs(value) > DEADZONE:
-                            self.controls.ry = math.copysign(
-                                math.pow(abs((value - math.copysign(DEADZONE, value)) / (1 - DEADZONE)), EXPO), value
-                            )
-                        else:
-                            self.controls.ry = 0
-                    elif event.code == "ABS_RX":
-                        value = event.state / XboxController.MAX_JOY_VAL  # normalize between -1 and 1
-                        if abs(value) > DEADZONE:
-                            self.controls.rx = math.copysign(
-                                math.pow(abs((value - math.copysign(DEADZONE, value)) / (1 - DEADZONE)), EXPO), value
-                            )
-                        else:
-                            self.controls.rx = 0
-                    elif event.code == "ABS_RZ":
-                        value = event.state / XboxController.MAX_TRIG_VAL  # normalize between -1 and 1
-                        if abs(value) > DEADZONE:
-                            self.controls.tr = (value - math.copysign(DEADZONE, value)) / (1 - DEADZONE)
-                        else:
-                            self.controls.tr = 0
-
-            else:
-                self.controlSignal.emit()
-                continue
-            break
-            # time.sleep(self.samplerate)
+            try:
+                events = get_gamepad()
+            except Exception as e:
+                self.messageSignal.emit(str(e))
+                break
+            self.feed(events)
+
+    def _flush(self) -> None:
+        # The first change after a pause is drawn at once, a burst is merged into one repaint per interval
+        while True:
+            with self.condition:
+                while not self.dirty:
+                    self.condition.wait()
+                self.dirty = False
+            self.updates += 1
+            self.controlSignal.emit()
+            time.sleep(self.interval)
@@ -0,0 +1,14 @@
+class Event(object):
+    # Stand-in for pyqtSignal outside Qt, callbacks run synchronously on the emitting thread
+    def __init__(self) -> None:
+        self.callbacks = []
+
+    def connect(self, callback) -> None:
+        self.callbacks.append(callback)
+
+    def disconnect(self, callback) -> None:
+        self.callbacks.remove(callback)
+
+    def emit(self, *args) -> None:
+        for callback in list(self.callbacks):
+            callback(*args)
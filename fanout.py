@@ -0,0 +1,161 @@
+import sys
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import numpy as np
+import codec
+
+BANNER = b"GSFAN1" + bytes([codec.FRAME.size])
+# Receive time as float64 seconds followed by the unmodified telemetry datagram
+RECORD_DTYPE = np.dtype([("timestamp", "<f8")] + codec.DTYPE.descr)
+
+
+class Subscriber(asyncio.Protocol):
+    def __init__(self, server: "FanoutServer") -> None:
+        self.server = server
+        self.transport = None
+        self.paused = False
+        self.sent = 0
+        self.dropped = 0
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        # Anything beyond a few dozen queued frames means the reader is behind, drop instead of buffering
+        transport.set_write_buffer_limits(high=self.server.limit)
+        transport.write(BANNER)
+        self.server.subscribers.add(self)
+
+    def connection_lost(self, exc) -> None:
+        self.server.subscribers.discard(self)
+
+    def pause_writing(self) -> None:
+        self.paused = True
+
+    def resume_writing(self) -> None:
+        self.paused = False
+
+    def data_received(self, data: bytes) -> None:
+        pass
+
+    def send(self, message: bytes, frames: int = 1) -> None:
+        if self.paused:
+            self.dropped += frames
+            self.server.dropped += frames
+            return
+        self.transport.write(message)
+        self.sent += frames
+
+
+class FanoutServer(object):
+    def __init__(self, limit: int = 64 * RECORD_DTYPE.itemsize) -> None:
+        self.limit = limit
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 4322) -> "FanoutServer":
+        self.server = await asyncio.get_running_loop().create_server(lambda: Subscriber(self), host, port)
+        return self
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    def publishFrames(self, raw: np.ndarray, arrivals: np.ndarray = None) -> None:
+        # Runs on the receive loop, writes are buffered by the transports and never wait for a reader.
+        # A decoded batch goes out as one write per subscriber, each frame with its own receive time
+        if len(self.subscribers) == 0:
+            return
+        records = np.empty(len(raw), dtype=RECORD_DTYPE)
+        records["timestamp"] = time.time() if arrivals is None else arrivals
+        for name in codec.DTYPE.names:
+            records[name] = raw[name]
+        message = records.tobytes()
+        for subscriber in list(self.subscribers):
+            subscriber.send(message, len(raw))
+        self.published += len(raw)
+
+    def stats(self) -> dict:
+        return dict(
+            subscribers=len(self.subscribers),
+            published=self.published,
+            dropped=self.dropped,
+            perSubscriber=[dict(sent=s.sent, dropped=s.dropped) for s in self.subscribers],
+        )
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+        for subscriber in list(self.subscribers):
+            subscriber.transport.close()
+
+
+class FanoutClient(object):
+    def __init__(self, host: str = "127.0.0.1", port: int = 4322, timeout: float = None) -> None:
+        self.socket = socket.create_connection((host, port))
+        self.socket.settimeout(timeout)
+        banner = self._readExactly(len(BANNER))
+        if banner != BANNER:
+            raise ValueError("unexpected fan-out banner {!r}".format(banner))
+        self._partial = b""
+
+    def _readExactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if len(chunk) == 0:
+                raise ConnectionError("fan-out server closed the connection")
+            data += chunk
+        return data
+
+    def read(self, size: int = 65536) -> np.ndarray:
+        # Blocks for the next data and returns every complete record received so far
+        chunk = self.socket.recv(size)
+        if len(chunk) == 0:
+            raise ConnectionError("fan-out server closed the connection")
+        data = self._partial + chunk
+        whole = len(data) - len(data) % RECORD_DTYPE.itemsize
+        self._partial = data[whole:]
+        return np.frombuffer(data[:whole], dtype=RECORD_DTYPE)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subscribe to the telemetry fan-out of a running ground station")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4322)
+    parser.add_argument("--log-dir", default=None, help="record the received frames to a flight log here")
+    args = parser.parse_args()
+
+    client = FanoutClient(args.host, args.port)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    blackbox = None
+    if args.log_dir is not None:
+        from connection import BlackBox
+
+        blackbox = BlackBox(compact=True, logDirectory=args.log_dir)
+        blackbox.start_recording()
+    count = 0
+    last = time.monotonic()
+    try:
+        while True:
+            records = client.read()
+            count += len(records)
+            if blackbox is not None:
+                blackbox.recordFrames(records, arrivals=records["timestamp"])
+            now = time.monotonic()
+            if now - last >= 1.0:
+                print("{:8.1f} frames/s".format(count / (now - last)))
+                count = 0
+                last = now
+    except (KeyboardInterrupt, ConnectionError):
+        pass
+    finally:
+        if blackbox is not None:
+            blackbox.stop_recording()
+        client.close()
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import zlib
+import struct
+import threading
+import numpy as np
+import codec
+
+MAGIC = b"GSLOG1\n"
+HEADER = struct.Struct("<I")
+# rows, payload bytes
+CHUNK = struct.Struct("<II")
+LENGTH = struct.Struct("<I")
+
+
+def fields(compact: bool) -> list:
+    # Every stored column as (field, component, dtype), subarray fields are split per component
+    if not compact:
+        return [(None, i, np.dtype("<f8")) for i in range(codec.COLUMNS + 1)]
+    dtype = np.dtype(codec.RECORD_DTYPE)
+    columns = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        if field.subdtype is None:
+            columns.append((name, None, field))
+        else:
+            base, shape = field.subdtype
+            columns.extend((name, k, base) for k in range(shape[0]))
+    return columns
+
+
+def table(chunk: np.ndarray, compact: bool) -> np.ndarray:
+    # Scaled columns in BlackBox order with the timestamp last
+    if not compact:
+        return chunk[:, : codec.COLUMNS + 1]
+    out = np.empty((len(chunk), codec.COLUMNS + 1))
+    out[:, : codec.COLUMNS] = codec.scale(chunk, chunk["altitude"])
+    out[:, codec.COLUMNS] = chunk["timestamp"]
+    return out
+
+
+def _encode(column: np.ndarray, level: int) -> bytes:
+    # Byte shuffle first, the high bytes of slowly changing values compress to almost nothing
+    data = np.ascontiguousarray(column)
+    return zlib.compress(data.view(np.uint8).reshape(len(data), data.itemsize).T.tobytes(), level)
+
+
+def _decode(buffer: bytes, dtype: np.dtype, rows: int) -> np.ndarray:
+    shuffled = np.frombuffer(zlib.decompress(buffer), dtype=np.uint8).reshape(dtype.itemsize, rows)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(rows)
+
+
+class LogWriter(object):
+    def __init__(self, blackbox, path: str, interval: float = 0.5, chunkRows: int = 500, level: int = 1) -> None:
+        self.blackbox = blackbox
+        self.path = path
+        self.interval = interval
+        self.chunkRows = chunkRows
+        self.level = level
+        self.compact = blackbox.compact
+        self.fields = fields(self.compact)
+        self.written = 0
+        self.bytes = 0
+        self._stop = threading.Event()
+        self._file = open(path, "xb")
+        header = json.dumps(dict(compact=self.compact, labels=blackbox.labels, created=time.time())).encode()
+        self._file.write(MAGIC + HEADER.pack(len(header)) + header)
+        self._file.flush()
+        self._thread = threading.Thread(target=self._run, args=())
+        self._thread.daemon = True
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._drain(False)
+        self._drain(True)
+        self._file.close()
+
+    def _drain(self, final: bool) -> None:
+        index = self.blackbox.index
+        if final:
+            end = index
+        else:
+            end = self.written + (index - self.written) // self.chunkRows * self.chunkRows
+        if end <= self.written:
+            return
+        for chunk in self.blackbox.chunks(self.written, end):
+            self._writeChunk(chunk)
+        self._file.flush()
+        self.written = end
+
+    def _writeChunk(self, chunk: np.ndarray) -> None:
+        parts = []
+        for name, component, _ in self.fields:
+            if name is None:
+                column = chunk[:, component]
+            elif component is None:
+                column = chunk[name]
+            else:
+                column = chunk[name][:, component]
+            data = _encode(column, self.level)
+            parts.append(LENGTH.pack(len(data)))
+            parts.append(data)
+        payload = b"".join(parts)
+        self._file.write(CHUNK.pack(len(chunk), len(payload)) + payload)
+        self.bytes += CHUNK.size + len(payload)
+
+
+class FlightLog(object):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a flight log".format(path))
+            try:
+                (length,) = HEADER.unpack(file.read(HEADER.size))
+                header = json.loads(file.read(length).decode())
+                self.compact = header["compact"]
+                self.labels = header["labels"]
+            except (struct.error, ValueError, KeyError, TypeError):
+                # Damaged files surface as ValueError like any other unreadable log
+                raise ValueError("{} has a damaged header".format(path)) from None
+            self.created = header.get("created")
+            self.fields = fields(self.compact)
+            # Chunk offsets, a chunk cut short by a crash ends the log
+            self.index = []
+            self.rows = 0
+            size = os.fstat(file.fileno()).st_size
+            offset = file.tell()
+            while offset + CHUNK.size <= size:
+                file.seek(offset)
+                rows, payload = CHUNK.unpack(file.read(CHUNK.size))
+                if offset + CHUNK.size + payload > size:
+                    break
+                self.index.append((offset + CHUNK.size, rows, payload))
+                self.rows += rows
+                offset += CHUNK.size + payload
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def chunks(self):
+        with open(self.path, "rb") as file:
+            for offset, rows, payload in self.index:
+                file.seek(offset)
+                try:
+                    chunk = self._readChunk(file.read(payload), rows)
+                except (struct.error, zlib.error, ValueError):
+                    raise ValueError("{} has a damaged chunk at byte {}".format(self.path, offset)) from None
+                yield chunk
+
+    def _readChunk(self, payload: bytes, rows: int) -> np.ndarray:
+        if self.compact:
+            chunk = np.empty(rows, dtype=codec.RECORD_DTYPE)
+        else:
+            chunk = np.empty((rows, codec.COLUMNS + 1))
+        position = 0
+        for name, component, dtype in self.fields:
+            (length,) = LENGTH.unpack_from(payload, position)
+            position += LENGTH.size
+            column = _decode(payload[position : position + length], dtype, rows)
+            position += length
+            if name is None:
+                chunk[:, component] = column
+            elif component is None:
+                chunk[name] = column
+            else:
+                chunk[name][:, component] = column
+        return chunk
+
+    def tables(self):
+        for chunk in self.chunks():
+            yield table(chunk, self.compact)
+
+    def table(self) -> np.ndarray:
+        parts = list(self.tables())
+        if len(parts) == 0:
+            return np.zeros((0, codec.COLUMNS + 1))
+        return np.concatenate(parts)
+
+
+def export(path: str, tables, labels: list) -> int:
+    labels = list(labels) + ["Timestamp"]
+    rows = 0
+    if path.endswith(".npz"):
+        parts = list(tables)
+        data = np.concatenate(parts) if len(parts) > 0 else np.zeros((0, len(labels)))
+        np.savez_compressed(path, **{label: data[:, i] for i, label in enumerate(labels)})
+        return len(data)
+    with open(path, "w") as file:
+        file.write(",".join(labels) + "\n")
+        for data in tables:
+            # One formatting call per block instead of one per row like np.savetxt, timestamps keep microseconds
+            line = ",".join(["%.7g"] * (data.shape[1] - 1) + ["%.6f"]) + "\n"
+            file.write((line * len(data)) % tuple(data.ravel().tolist()))
+            rows += len(data)
+    return rows
+
+
+def exportBlackBox(path: str, blackbox) -> int:
+    return export(path, (table(chunk, blackbox.compact) for chunk in blackbox.chunks()), blackbox.labels)
+
+
+def exportLog(path: str, log: FlightLog) -> int:
+    return export(path, log.tables(), log.labels)
+
+
+class Replay(object):
+    def __init__(self, log: FlightLog, telemetry, blackbox=None, speed: float = 1.0) -> None:
+        self.log = log
+        self.telemetry = telemetry
+        self.blackbox = blackbox
+        # Playback speed factor, 0 replays as fast as possible
+        self.speed = speed
+        self.frames = 0
+        self.elapsed = 0.0
+        self.running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, args=())
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self) -> None:
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        start = time.monotonic()
+        first = None
+        for block in self.log.tables():
+            for row in block.tolist():
+                if first is None:
+                    first = row[14]
+                if self.speed > 0:
+                    delay = start + (row[14] - first) / self.speed - time.monotonic()
+                    if delay > 0 and self._stop.wait(delay):
+                        break
+                if self._stop.is_set():
+                    break
+                self._apply(row)
+                self.frames += 1
+            if self._stop.is_set():
+                break
+        self.elapsed = time.monotonic() - start
+        self.running = False
+
+    def _apply(self, row: list) -> None:
+        self.telemetry.altitude = row[10]
+        self.telemetry.publish(codec.encode(row))
+        if self.blackbox is not None:
+            self.blackbox.record(self.telemetry)
@@ -0,0 +1,100 @@
+import time
+
+START = time.perf_counter()
+
+import sys
+import signal
+import argparse
+from events import Event
+from connection import Tower, Telemetry, BlackBox
+from devices import XboxController, Controls
+from startup import maxRss
+
+IMPORTED = time.perf_counter()
+
+
+class Recorder(object):
+    def __init__(self, target: str, port: int, logDirectory: str, gamepad: bool, fanoutPort: int = None) -> None:
+        self.target = target
+        self.parameters = dict()
+        self.messages = Event()
+        self.messages.connect(lambda message: print("message:", message, file=sys.stderr))
+        self.parameterEvent = Event()
+        self.parameterEvent.connect(self._onParameters)
+
+        self.telemetry = Telemetry()
+        self.blackbox = BlackBox(compact=True, logDirectory=logDirectory)
+        self.controls = Controls()
+        self.tower = Tower(target, port)
+        self.tower.connectSignals(Event(), self.parameterEvent, self.messages)
+        self.tower.connectClasses(self.telemetry, self.blackbox, self.controls)
+        if fanoutPort is not None:
+            self.tower.startFanout(fanoutPort)
+        self.controller = None
+        if gamepad:
+            self.controller = XboxController(self.controls, 1)
+            self.controller.connectSignals(Event(), self.messages)
+
+    def _onParameters(self, parameters: list) -> None:
+        for group, child, value, id in parameters:
+            self.parameters[id] = (group, child, value)
+
+    def start(self) -> bool:
+        self.tower.getHandshake(self.target)
+        if not self.tower.connected:
+            return False
+        self.blackbox.start_recording()
+        self.tower.runTelemetry()
+        if self.controller is not None:
+            self.controller.connect()
+            self.tower.runControl()
+        return True
+
+    def stop(self) -> None:
+        self.tower.controlled = False
+        self.blackbox.stop_recording()
+
+    def status(self) -> str:
+        stats = self.tower.getLinkStats().get("Telemetry", dict())
+        return "frames {:8d}  rate {:6.1f}/s  loss {:5.1%}  armed {}".format(
+            self.blackbox.index, stats.get("rate", 0.0), stats.get("loss", 0.0), self.telemetry.armed
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record telemetry without the GUI")
+    parser.add_argument("--target", default="192.168.4.1", help="copter IP address")
+    parser.add_argument("--port", type=int, default=4321)
+    parser.add_argument("--log-dir", default="logs", help="flight logs are written here")
+    parser.add_argument("--no-gamepad", action="store_true", help="record only, do not send control frames")
+    parser.add_argument("--fanout", type=int, default=None, help="republish telemetry to local subscribers")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between status lines")
+    args = parser.parse_args()
+
+    recorder = Recorder(args.target, args.port, args.log_dir, not args.no_gamepad, args.fanout)
+    ready = time.perf_counter()
+    rss = maxRss()
+    print(
+        "startup {:.0f} ms (imports {:.0f} ms), max RSS {}".format(
+            (ready - START) * 1000, (IMPORTED - START) * 1000, "n/a" if rss is None else "{:.1f} MB".format(rss)
+        )
+    )
+    if not recorder.start():
+        sys.exit(1)
+    print("connected to {}:{}, {} parameters".format(args.target, args.port, len(recorder.parameters)))
+    for id, (group, child, value) in sorted(recorder.parameters.items()):
+        print("  {:<14} {:<18} {:g}".format(group, child, value))
+
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    end = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        while recorder.tower.connected and (end is None or time.monotonic() < end):
+            time.sleep(args.interval if end is None else max(0.0, min(args.interval, end - time.monotonic())))
+            print(recorder.status())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.stop()
+        if recorder.blackbox.logDirectory is not None:
+            print("recorded {} frames to {}".format(recorder.blackbox.index, recorder.blackbox.logDirectory))
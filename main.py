@@ -1,11 +1,24 @@
 # pylint: disable=missing-docstring
-import sys
-import matplotlib
+import time
+
+START = time.perf_counter()
 
-matplotlib.use("Qt5Agg")
-from classes import Horizon, Configuration, ControlStick, DroneThrust, Heading, DataSelector, PlotCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
+import sys
+import json
+import argparse
+from classes import (
+    Horizon,
+    Configuration,
+    ControlStick,
+    DroneThrust,
+    Heading,
+    DataSelector,
+    LinkOverlay,
+    RedrawScheduler,
+)
 from connection import Tower, Telemetry, BlackBox
+from startup import StartupProfile, maxRss
+from flightlog import FlightLog, Replay
 from devices import XboxController, Controls
 from PyQt5.QtGui import QFont
 from PyQt5.QtCore import pyqtSignal, QTimer
@@ -21,18 +34,21 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QMessageBox,
     QLabel,
+    QProgressBar,
 )
 
 
 class MainWindow(QWidget):
-    configUpdate = pyqtSignal(str, str)
-    addItem = pyqtSignal(str, str, float, int)
+    configUpdate = pyqtSignal(int, str)
+    parameters = pyqtSignal(list)
     messageSignal = pyqtSignal(str)
+    progressSignal = pyqtSignal(str, int, int)
     controlSignal = pyqtSignal()
     periodic = QTimer()
 
-    def __init__(self, size=()):
+    def __init__(self, size=(), logDirectory=None, fanoutPort=None, profile=None):
         super(MainWindow, self).__init__()
+        self.profile = StartupProfile() if profile is None else profile
         self.wt_root = QWidget()
         self.wt_root.resize(1920, 1100)
         self.wt_root.setWindowTitle("Horizon")
@@ -61,6 +77,8 @@ class MainWindow(QWidget):
         self.fe_animation.setLayout(self.lt_animation)
         self.lt_graph = QGridLayout()
         self.fe_graph.setLayout(self.lt_graph)
+        self.tb_main.currentChanged.connect(self.showTab)
+        self.profile.lap("layout")
 
         # Animation
         self.ll_ip = QLabel(self.fe_connect)
@@ -71,54 +89,96 @@ class MainWindow(QWidget):
         self.lt_connect.addWidget(self.le_ip)
         self.pb_connect = QPushButton("connect", self.fe_info)
         self.lt_info.addWidget(self.pb_connect)
+        self.br_progress = QProgressBar(self.fe_info)
+        self.br_progress.setVisible(False)
+        self.lt_info.addWidget(self.br_progress)
         self.config = Configuration(self.fe_info)
         self.lt_info.addWidget(self.config.getWidget())
         self.pb_update = QPushButton("write config", self.fe_info)
         self.lt_info.addWidget(self.pb_update)
         self.pb_connect.clicked.connect(self.connect)
         self.pb_update.clicked.connect(self.configurate)
+        self.profile.lap("configuration")
 
         self.horizon = Horizon(None, size=(900, 900))
         self.control_left = ControlStick(size=(300, 300))
         self.control_right = ControlStick(size=(300, 300))
         self.drone_thrust = DroneThrust()
         self.heading = Heading()
+        self.overlay = LinkOverlay(self.horizon.getWidget())
+        self.profile.lap("instruments")
         self.controls = Controls()
         self.controller = XboxController(self.controls, 1)
         self.controller.connectSignals(self.controlSignal, self.messageSignal)
+        self.profile.lap("controller")
 
-        self.blackbox = BlackBox()
+        self.blackbox = BlackBox(compact=True, logDirectory=logDirectory)
+        self.replayer = None
         self.telemetry = Telemetry()
         self.tower = Tower()
-        self.tower.connectSignals(self.configUpdate, self.addItem, self.messageSignal)
+        self.tower.connectSignals(self.configUpdate, self.parameters, self.messageSignal, self.progressSignal)
         self.tower.connectClasses(self.telemetry, self.blackbox, self.controls)
+        if fanoutPort is not None:
+            self.tower.startFanout(fanoutPort)
+        self.profile.lap("tower")
         self.configUpdate.connect(self.config.changeColor)
-        self.addItem.connect(self.config.addItem)
+        self.parameters.connect(self.config.load)
         self.messageSignal.connect(self.showDialog)
+        self.progressSignal.connect(self.showProgress)
         self.periodic.timeout.connect(self.redrawTelemetry)
         self.controlSignal.connect(self.redrawControl)
+        self.scheduler = RedrawScheduler(self.periodic)
+        # Thresholds are about one pixel on each instrument
+        self.scheduler.addWidget(lambda frame: frame.engines, (0.015, 0.015, 0.015, 0.015), self.drone_thrust.update)
+        self.scheduler.addWidget(
+            lambda frame: frame.attitude[:2] + (frame.altitude, frame.voltage), (0.1, 0.1, 1, 1), self.horizon.update
+        )
+        self.scheduler.addWidget(lambda frame: frame.attitude[2:], (0.5,), self.heading.update)
+        self.scheduler.addWidget(
+            lambda frame: (self.controls.lx, self.controls.ly), (0.007, 0.007), self.control_left.update, control=True
+        )
+        self.scheduler.addWidget(
+            lambda frame: (self.controls.rx, self.controls.ry), (0.007, 0.007), self.control_right.update, control=True
+        )
+        self.linkTimer = QTimer()
+        self.linkTimer.timeout.connect(self.redrawLink)
 
         self.lt_animation.addWidget(self.control_left.getWidget(), 1, 0)
         self.lt_animation.addWidget(self.heading.getWidget(), 0, 0)
         self.lt_animation.addWidget(self.horizon.getWidget(), 0, 1, 2, 1)
         self.lt_animation.addWidget(self.control_right.getWidget(), 1, 2)
         self.lt_animation.addWidget(self.drone_thrust.getWidget(), 0, 2)
+        self.profile.lap("animation")
+
+        # Graph, built on the first visit of the tab
+        self.figure = None
+        self.spectrum = None
+
+    def showTab(self, index):
+        if index == 1 and self.figure is None:
+            self.buildGraphs()
+
+    def buildGraphs(self):
+        # matplotlib and the canvases cost more than the rest of the window, most sessions never open the graphs
+        started = time.perf_counter()
+        from plots import PlotCanvas, SpectrumCanvas, NavigationToolbar2QT
 
-        # Graph
         self.figure = PlotCanvas(self.fe_graph)
         self.figure.setBlackBox(self.blackbox)
         self.navbar = NavigationToolbar2QT(self.figure, self.fe_graph)
         self.lt_graph.addWidget(self.navbar, 0, 1)
         self.lt_graph.addWidget(self.figure, 1, 1)
+        self.spectrum = SpectrumCanvas(self.fe_graph)
+        self.spectrum.setBlackBox(self.blackbox)
+        self.lt_graph.addWidget(self.spectrum, 2, 1)
         self.selector = DataSelector(self.fe_graph)
-        self.selector.setPointer(self.figure, self.blackbox)
-        self.lt_graph.addWidget(self.selector.getWidget(), 0, 0, 2, 1)
+        self.selector.setPointer(self.figure, self.blackbox, self.spectrum)
+        self.lt_graph.addWidget(self.selector.getWidget(), 0, 0, 3, 1)
+        self.profile.lap("graphs", since=started)
 
     def connect(self):
         self.config.clear()
-        self.tower.getHandshake(self.le_ip.text())
-        self.tower.runTelemetry()
-        self.tower.runControl()
+        self.tower.connect(self.le_ip.text())
 
     def configurate(self):
         self.tower.updateConfig(self.config.getDiff())
@@ -131,22 +191,34 @@ class MainWindow(QWidget):
         msgbox.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
         msgbox.exec_()
 
+    def showProgress(self, task, done, total):
+        self.br_progress.setFormat(task + " %v/%m")
+        self.br_progress.setRange(0, total)
+        self.br_progress.setValue(done)
+        self.br_progress.setVisible(done < total)
+
     def redrawTelemetry(self):
-        eng = self.telemetry.engines
         if self.tb_main.currentIndex() == 0:
-            self.drone_thrust.update(eng[0], eng[1], eng[2], eng[3])
-            att = self.telemetry.attitude
-            self.horizon.update(att[0], att[1], self.telemetry.altitude, self.telemetry.voltage)
-            self.heading.update(att[2])
-            self.wt_root.update()
+            if self.scheduler.frame(self.telemetry.snapshot()):
+                self.wt_root.update()
         elif self.tb_main.currentIndex() == 1:
+            self.periodic.setInterval(self.scheduler.interval)
             self.figure.drawPlot()
+            self.spectrum.drawPlot()
 
-    def redrawControl(self):
+    def replay(self, path, speed=1.0):
+        if self.replayer is not None:
+            self.replayer.stop()
+        self.replayer = Replay(FlightLog(path), self.telemetry, self.blackbox, speed)
+        self.replayer.start()
+
+    def redrawLink(self):
         if self.tb_main.currentIndex() == 0:
-            self.control_left.update(self.controls.lx, self.controls.ly)
-            self.control_right.update(self.controls.rx, self.controls.ry)
-            self.wt_root.update()
+            self.overlay.update(self.tower.getLinkStats())
+
+    def redrawControl(self):
+        # Drawn with the next telemetry frame instead of once per gamepad event
+        self.scheduler.markControl()
 
     def show(self):
         self.control_left.update(0.0, 0.0)
@@ -157,11 +229,37 @@ class MainWindow(QWidget):
         self.controller.connect()
         self.periodic.setInterval(25)
         self.periodic.start()
+        self.linkTimer.setInterval(500)
+        self.linkTimer.start()
         self.wt_root.show()
+        self.profile.lap("show")
+
+    def profileStartup(self):
+        # Runs once the event loop has painted the first frame
+        self.profile.lap("first paint")
+        report = dict(startupRss_mb=maxRss(), matplotlibAtStartup="matplotlib" in sys.modules)
+        self.buildGraphs()
+        report.update(laps_ms=self.profile.laps, maxRss_mb=maxRss())
+        print(json.dumps(report, indent=2))
+        QApplication.instance().quit()
 
 
-app = QApplication(sys.argv)
-main = MainWindow()
+parser = argparse.ArgumentParser(description="ESP32 ground station")
+parser.add_argument("--log-dir", default=None, help="stream every recording to a flight log in this directory")
+parser.add_argument("--replay", default=None, help="flight log to play back into the instruments")
+parser.add_argument("--fanout", type=int, default=None, help="republish telemetry to local subscribers on this port")
+parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 plays as fast as possible")
+parser.add_argument("--profile-startup", action="store_true", help="print per widget startup cost as JSON and exit")
+args, qtArgs = parser.parse_known_args()
+profile = StartupProfile(START)
+profile.lap("imports")
+app = QApplication(sys.argv[:1] + qtArgs)
+profile.lap("application")
+main = MainWindow(logDirectory=args.log_dir, fanoutPort=args.fanout, profile=profile)
 app.setStyle("Oxygen")
 main.show()
+if args.profile_startup:
+    QTimer.singleShot(0, main.profileStartup)
+if args.replay is not None:
+    main.replay(args.replay, args.speed)
 sys.exit(app.exec_())
@@ -0,0 +1,209 @@
+import matplotlib
+
+matplotlib.use("Qt5Agg")
+import numpy as np
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT
+from matplotlib.figure import Figure
+from PyQt5.QtWidgets import QSizePolicy
+from connection import BlackBox
+from decimation import MinMaxPyramid
+from spectrum import WelchSpectrum
+
+
+class PlotCanvas(FigureCanvas):
+    def __init__(self, parent=None, width=10, height=8, dpi=100):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvas.__init__(self, fig)
+        self.setParent(parent)
+        FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
+        FigureCanvas.updateGeometry(self)
+        self.index2plot = []
+        self.lines = []
+        self.lod = []
+        self.background = None
+        self.window_size = 100
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_title("PyQt Matplotlib Example")
+        self.colors = ["r-", "g-", "b-", "y-", "c-", "m-", "k-"]
+        self.mpl_connect("draw_event", self._onDraw)
+        self.draw()
+
+    def setBlackBox(self, blackbox: BlackBox):
+        self.blackbox = blackbox
+
+    def _limits(self):
+        # Kept up to date by the blackbox on every recorded frame
+        return self.blackbox.limits(self.index2plot)
+
+    def _setLimits(self, low, high):
+        margin = 0.05 * (high - low) if high > low else 1.0
+        self.ax.set_ylim([low - margin, high + margin])
+
+    def _plotWindow(self, window_size, animated):
+        index = self.blackbox.index
+        self.lines = []
+        for x, i in enumerate(self.index2plot):
+            (line,) = self.ax.plot(
+                range(window_size),
+                self.blackbox.column(i, index - window_size, index),
+                self.colors[x % len(self.colors)],
+                linewidth=1,
+                label=self.blackbox.labels[i],
+                animated=animated,
+            )
+            self.lines.append(line)
+        self.ax.legend()
+
+    def _onDraw(self, event):
+        # Cache everything but the animated lines, then put the lines back on top
+        self.background = self.copy_from_bbox(self.ax.bbox)
+        for line in self.lines:
+            if line.get_animated():
+                self.ax.draw_artist(line)
+
+    def start(self, index2plot):
+        self.index2plot = index2plot
+        self.ax.cla()
+        self.ax.set_title("PyQt Matplotlib Example")
+        self.lines = []
+        self.lod = []
+        self.background = None
+
+    def updatePlot(self, index2plot):
+        if len(index2plot) == 0:
+            return
+        self.index2plot = index2plot
+        if not self.blackbox.recording:
+            # A finished session is shown through the min/max pyramids like at the end of the recording
+            self.end()
+            return
+        if self.blackbox.index < self.window_size:
+            return
+        self.ax.cla()
+        self._plotWindow(self.window_size, animated=True)
+        self.ax.set_ylim(self._limits())
+        self.draw()
+
+    def end(self):
+        self.ax.cla()
+        self.lines = []
+        self.lod = []
+        if self.blackbox.index == 0:
+            self.draw()
+            return
+        timestamp = self.blackbox.timestamps()
+        pixels = self.ax.bbox.width
+        for x, i in enumerate(self.index2plot):
+            pyramid = MinMaxPyramid(timestamp, self.blackbox.column(i))
+            (line,) = self.ax.plot(
+                *pyramid.select(*pyramid.extent(), pixels),
+                self.colors[x % len(self.colors)],
+                linewidth=0.5,
+                label=self.blackbox.labels[i],
+            )
+            self.lod.append((line, pyramid))
+        if timestamp[-1] > timestamp[0]:
+            self.ax.set_xlim(timestamp[0], timestamp[-1])
+        self.ax.legend()
+        self.ax.callbacks.connect("xlim_changed", self._onZoom)
+        self.draw()
+
+    def _onZoom(self, ax):
+        # Reselect the level of detail so about one min/max pair per pixel is drawn
+        xmin, xmax = ax.get_xlim()
+        for line, pyramid in self.lod:
+            line.set_data(*pyramid.select(xmin, xmax, ax.bbox.width))
+        self.draw_idle()
+
+    def drawPlot(self):
+        if not self.blackbox.recording or len(self.index2plot) == 0:
+            return
+        index = self.blackbox.index
+        if index < self.window_size:
+            return
+        if len(self.lines) == 0:
+            self._plotWindow(self.window_size, animated=True)
+            self.background = None
+        for x, i in enumerate(self.index2plot):
+            self.lines[x].set_ydata(self.blackbox.column(i, index - self.window_size, index))
+        low, high = self._limits()
+        bottom, top = self.ax.get_ylim()
+        if self.background is None or low < bottom or high > top:
+            self._setLimits(low, high)
+            self.draw()
+            return
+        self.restore_region(self.background)
+        for line in self.lines:
+            self.ax.draw_artist(line)
+        self.blit(self.ax.bbox)
+
+
+class SpectrumCanvas(FigureCanvas):
+    def __init__(self, parent=None, width=10, height=4, dpi=100):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvas.__init__(self, fig)
+        self.setParent(parent)
+        FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
+        FigureCanvas.updateGeometry(self)
+        self.index2plot = []
+        self.engine = None
+        self.lines = []
+        self.image = None
+        self.drawn = 0
+        self.colors = ["r-", "g-", "b-", "y-", "c-", "m-", "k-"]
+        self.ax_psd = self.figure.add_subplot(121)
+        self.ax_spec = self.figure.add_subplot(122)
+        self.draw()
+
+    def setBlackBox(self, blackbox: BlackBox):
+        self.blackbox = blackbox
+
+    def start(self, index2plot):
+        self.index2plot = index2plot
+        self.engine = WelchSpectrum(index2plot) if len(index2plot) > 0 else None
+        self.drawn = 0
+        self.lines = []
+        self.image = None
+        self.ax_psd.cla()
+        self.ax_spec.cla()
+        self.draw()
+
+    def end(self):
+        self.drawPlot()
+
+    def drawPlot(self):
+        if self.engine is None:
+            return
+        # Only the samples recorded since the last call are resampled and transformed
+        self.engine.update(self.blackbox)
+        if self.engine.segments == self.drawn:
+            return
+        self.drawn = self.engine.segments
+        psd = self.engine.psd()
+        if len(self.lines) == 0:
+            for x, i in enumerate(self.index2plot):
+                (line,) = self.ax_psd.semilogy(
+                    self.engine.frequencies, psd[x], self.colors[x % len(self.colors)], label=self.blackbox.labels[i]
+                )
+                self.lines.append(line)
+            self.ax_psd.set_xlabel("Frequency [Hz]")
+            self.ax_psd.set_title("Welch PSD")
+            self.ax_psd.legend()
+        else:
+            for x, line in enumerate(self.lines):
+                line.set_ydata(psd[x])
+            self.ax_psd.relim()
+            self.ax_psd.autoscale_view()
+        times, rows = self.engine.rows()
+        filled = ~np.isnan(times)
+        image = 10 * np.log10(rows[filled, 0, :].T + 1e-12)
+        extent = [times[filled][0], times[filled][-1] + 1e-3, 0, self.engine.frequencies[-1]]
+        if self.image is None:
+            self.image = self.ax_spec.imshow(image, aspect="auto", origin="lower", extent=extent)
+            self.ax_spec.set_xlabel("Time [s]")
+            self.ax_spec.set_title(self.blackbox.labels[self.index2plot[0]] + " [dB]")
+        else:
+            self.image.set_data(image)
+            self.image.set_extent(extent)
+        self.image.set_clim(np.nanmin(image), np.nanmax(image))
+        self.draw_idle()
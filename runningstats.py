@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class RunningStats(object):
+    def __init__(self, width: int, window: int = 500) -> None:
+        self.width = width
+        self.window = window
+        self.reset()
+
+    def reset(self) -> None:
+        # Whole recording, Chan's parallel merge of each block into the running mean and variance
+        self.count = 0
+        self.mean = np.zeros(self.width)
+        self.m2 = np.zeros(self.width)
+        self.min = np.full(self.width, np.inf)
+        self.max = np.full(self.width, -np.inf)
+        # Rolling window over the last `window` rows, split into aligned blocks of that length.
+        # The window is the tail of the previous block (suffix extrema) plus the head of the current one.
+        self._ring = np.zeros((self.window, self.width))
+        self._prefixMin = np.full(self.width, np.inf)
+        self._prefixMax = np.full(self.width, -np.inf)
+        self._suffixMin = None
+        self._suffixMax = None
+        self._shift = None
+        self._sum = np.zeros(self.width)
+        self._sumsq = np.zeros(self.width)
+
+    def extend(self, rows: np.ndarray) -> None:
+        if len(rows) == 0:
+            return
+        if self._shift is None:
+            self._shift = rows[0].copy()
+        count = self.count + len(rows)
+        mean = rows.mean(axis=0)
+        delta = mean - self.mean
+        self.m2 += ((rows - mean) ** 2).sum(axis=0) + delta * delta * self.count * len(rows) / count
+        self.mean += delta * len(rows) / count
+        np.minimum(self.min, rows.min(axis=0), out=self.min)
+        np.maximum(self.max, rows.max(axis=0), out=self.max)
+
+        offset = 0
+        while offset < len(rows):
+            position = self.count % self.window
+            take = min(len(rows) - offset, self.window - position)
+            piece = rows[offset : offset + take]
+            if self._suffixMin is not None:
+                old = self._ring[position : position + take] - self._shift
+                self._sum -= old.sum(axis=0)
+                self._sumsq -= (old * old).sum(axis=0)
+            self._ring[position : position + take] = piece
+            new = piece - self._shift
+            self._sum += new.sum(axis=0)
+            self._sumsq += (new * new).sum(axis=0)
+            np.minimum(self._prefixMin, piece.min(axis=0), out=self._prefixMin)
+            np.maximum(self._prefixMax, piece.max(axis=0), out=self._prefixMax)
+            self.count += take
+            offset += take
+            if position + take == self.window:
+                self._closeBlock()
+
+    def _closeBlock(self) -> None:
+        self._suffixMin = np.minimum.accumulate(self._ring[::-1], axis=0)[::-1].copy()
+        self._suffixMax = np.maximum.accumulate(self._ring[::-1], axis=0)[::-1].copy()
+        self._prefixMin.fill(np.inf)
+        self._prefixMax.fill(-np.inf)
+        # Resum once per block so the add and subtract updates never drift
+        shifted = self._ring - self._shift
+        self._sum = shifted.sum(axis=0)
+        self._sumsq = (shifted * shifted).sum(axis=0)
+
+    def total(self) -> dict:
+        return dict(
+            count=self.count,
+            mean=self.mean.copy(),
+            variance=self.m2 / (self.count - 1) if self.count > 1 else np.zeros(self.width),
+            min=self.min.copy(),
+            max=self.max.copy(),
+        )
+
+    def rolling(self) -> dict:
+        count = min(self.count, self.window)
+        position = self.count % self.window
+        low = self._prefixMin.copy()
+        high = self._prefixMax.copy()
+        if self._suffixMin is not None:
+            np.minimum(low, self._suffixMin[position], out=low)
+            np.maximum(high, self._suffixMax[position], out=high)
+        if count == 0:
+            mean = np.zeros(self.width)
+            variance = np.zeros(self.width)
+        else:
+            mean = self._sum / count
+            variance = np.maximum(self._sumsq - self._sum * mean, 0.0) / max(count - 1, 1)
+            mean = mean + self._shift
+        return dict(count=count, mean=mean, variance=variance, min=low, max=high)
+
+    def limits(self, columns: list, rolling: bool = False) -> tuple:
+        if rolling:
+            stats = self.rolling()
+        else:
+            stats = self.total()
+        low, high = stats["min"], stats["max"]
+        return float(np.min(low[columns])), float(np.max(high[columns]))
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import random
+import struct
+import codec
+from connection import (
+    NAMES,
+    HANDSHAKE,
+    PARAMETER_READ,
+    PARAMETER_WRITE,
+    TELEMETRY_ENABLE,
+    CONTROL,
+    CONTROL_FRAME,
+)
+
+DEFAULTS = {
+    1: 0.0,
+    2: 1.0,
+    3: 0.9,
+    4: 0.95,
+    11: 1.0,
+    12: 1.0,
+    13: 1.0,
+}
+
+
+class Dynamics(object):
+    MAX_ANGLE = 30.0
+    MAX_YAW_RATE = 90.0
+    RESPONSE = 6.0
+
+    def __init__(self, generator: random.Random = None) -> None:
+        # The simulator's seeded generator, so --seed covers the sensor noise too
+        self.random = generator if generator is not None else random.Random()
+        self.armed = False
+        self.attitude = [0.0, 0.0, 0.0]
+        self.targetAttitude = [0.0, 0.0, 0.0]
+        self.thrust = 0.0
+        self.yawRate = 0.0
+        self.engines = [0.0, 0.0, 0.0, 0.0]
+        self.voltage = 4200.0
+        self.cycletime = 2500
+
+    def control(self, arm: int, pitch: int, roll: int, yaw: int, thrust: int) -> None:
+        self.armed = arm != 0
+        self.targetAttitude[0] = roll / 32000 * Dynamics.MAX_ANGLE
+        self.targetAttitude[1] = pitch / 32000 * Dynamics.MAX_ANGLE
+        self.yawRate = yaw / 32000 * Dynamics.MAX_YAW_RATE
+        self.thrust = max(0.0, thrust / 32000)
+
+    def step(self, dt: float) -> None:
+        if not self.armed:
+            self.engines = [0.0, 0.0, 0.0, 0.0]
+            self.voltage = min(4200.0, self.voltage + 0.5 * dt)
+            return
+        self.targetAttitude[2] = (self.targetAttitude[2] + self.yawRate * dt + 180) % 360 - 180
+        gain = min(1.0, Dynamics.RESPONSE * dt)
+        errors = []
+        for axis in range(3):
+            error = self.targetAttitude[axis] - self.attitude[axis]
+            if axis == 2:
+                error = (error + 180) % 360 - 180
+            self.attitude[axis] += gain * error + self.random.gauss(0.0, 0.05)
+            errors.append(error / Dynamics.MAX_ANGLE)
+        roll, pitch, yaw = errors
+        mix = [
+            self.thrust + roll - pitch - yaw,
+            self.thrust - roll - pitch + yaw,
+            self.thrust + roll + pitch + yaw,
+            self.thrust - roll + pitch - yaw,
+        ]
+        self.engines = [min(1.0, max(0.0, x)) for x in mix]
+        self.voltage = max(3000.0, self.voltage - (5.0 + 60.0 * sum(self.engines) / 4) * dt)
+        self.cycletime = 2500 + self.random.randint(-50, 50)
+
+    def frame(self) -> bytes:
+        return codec.FRAME.pack(
+            codec.TELEMETRY_TYPE,
+            int(self.armed),
+            self.cycletime,
+            *[int(round(x * codec.ATTITUDE_SCALE)) for x in self.attitude],
+            *[int(round(x * codec.ENGINE_OFFSET + codec.ENGINE_OFFSET)) for x in self.engines],
+            int(self.voltage) * codec.VOLTAGE_DIVIDER,
+            *[int(round(x * codec.ATTITUDE_SCALE)) for x in self.targetAttitude],
+        )
+
+
+class Simulator(asyncio.DatagramProtocol):
+    def __init__(
+        self, rate: float = 50.0, loss: float = 0.0, latency: float = 0.0, jitter: float = 0.0, seed: int = None
+    ) -> None:
+        self.rate = rate
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.transport = None
+        self.client = None
+        self.streamTask = None
+        self.dynamics = Dynamics(self.random)
+        self.parameters = {id: DEFAULTS.get(id, 0.0) for id, name in NAMES.items() if name != "Unkown"}
+        self.handlers = {
+            HANDSHAKE: self._onHandshake,
+            PARAMETER_READ: self._onRead,
+            PARAMETER_WRITE: self._onWrite,
+            TELEMETRY_ENABLE: self._onTelemetryEnable,
+            CONTROL: self._onControl,
+        }
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc) -> None:
+        self.client = None
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) == 0 or self.random.random() < self.loss:
+            return
+        handler = self.handlers.get(data[0])
+        if handler is not None:
+            handler(data, addr)
+
+    def send(self, data: bytes, addr) -> None:
+        if self.transport.is_closing() or self.random.random() < self.loss:
+            return
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._sendNow, data, addr)
+        else:
+            self.transport.sendto(data, addr)
+
+    def _sendNow(self, data: bytes, addr) -> None:
+        if not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+    def _onHandshake(self, data: bytes, addr) -> None:
+        ids = sorted(self.parameters.keys())
+        self.send(bytes([HANDSHAKE, len(ids)] + ids), addr)
+
+    def _onRead(self, data: bytes, addr) -> None:
+        if len(data) == 2 and data[1] in self.parameters:
+            self.send(data[:2] + struct.pack("f", self.parameters[data[1]]), addr)
+
+    def _onWrite(self, data: bytes, addr) -> None:
+        if len(data) == 6 and data[1] in self.parameters:
+            self.parameters[data[1]] = struct.unpack("f", data[2:])[0]
+            self.send(data, addr)
+
+    def _onTelemetryEnable(self, data: bytes, addr) -> None:
+        if len(data) != 2:
+            return
+        self.send(data, addr)
+        if data[1] != 0:
+            self.client = addr
+            if self.streamTask is None:
+                self.streamTask = asyncio.ensure_future(self._stream())
+        else:
+            self.client = None
+
+    def _onControl(self, data: bytes, addr) -> None:
+        if len(data) == CONTROL_FRAME.size:
+            self.dynamics.control(*CONTROL_FRAME.unpack(data)[1:])
+
+    async def _stream(self) -> None:
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+        deadline = loop.time()
+        last = deadline
+        while self.client is not None:
+            now = loop.time()
+            self.dynamics.step(now - last)
+            last = now
+            self.send(self.dynamics.frame(), self.client)
+            deadline += period
+            if deadline <= now:
+                deadline += ((now - deadline) // period + 1) * period
+            await asyncio.sleep(deadline - now)
+        self.streamTask = None
+
+
+async def serve(host: str = "127.0.0.1", port: int = 4321, **kwargs):
+    return await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: Simulator(**kwargs), local_addr=(host, port)
+    )
+
+
+async def _main(args) -> None:
+    transport, simulator = await serve(
+        args.host, args.port, rate=args.rate, loss=args.loss, latency=args.latency, jitter=args.jitter, seed=args.seed
+    )
+    print("Simulating ESP32 on {}:{} at {} Hz".format(args.host, args.port, args.rate))
+    try:
+        while True:
+            await asyncio.sleep(1.0)
+    finally:
+        transport.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ESP32 flight controller simulator speaking the Tower UDP protocol")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4321)
+    parser.add_argument("--rate", type=float, default=50.0, help="telemetry frames per second")
+    parser.add_argument("--loss", type=float, default=0.0, help="packet loss probability per direction")
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform latency jitter in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
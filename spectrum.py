@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class WelchSpectrum(object):
+    def __init__(
+        self, channels: list, rate: float = None, segment: int = 256, overlap: float = 0.5, history: int = 120
+    ):
+        self.channels = list(channels)
+        # Resampling rate in Hz, estimated from the first timestamps when not given
+        self.rate = rate
+        self.segment = segment
+        self.hop = max(1, int(segment * (1 - overlap)))
+        self.history = history
+        self.window = np.hanning(segment)
+        self.frequencies = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.consumed = 0
+        self.segments = 0
+        self._next = None
+        self._last = None
+        self._end = None
+        self._buffer = np.zeros((len(self.channels), 0))
+        self._sum = None
+        self.spectrogram = None
+        self.times = np.full(self.history, np.nan)
+        self._row = 0
+
+    def update(self, blackbox) -> int:
+        index = blackbox.index
+        if index < self.consumed:
+            self.reset()
+        if index <= self.consumed or (self.rate is None and index - self.consumed < 32):
+            return 0
+        timestamp = blackbox.timestamps(self.consumed, index).astype(np.float64)
+        values = np.array([blackbox.column(i, self.consumed, index) for i in self.channels], dtype=np.float64)
+        self.consumed = index
+        return self.extend(timestamp, values)
+
+    def extend(self, timestamp: np.ndarray, values: np.ndarray) -> int:
+        # Carry the previous sample so interpolation is continuous across chunks
+        if self._last is not None:
+            timestamp = np.concatenate(([self._last[0]], timestamp))
+            values = np.concatenate((self._last[1][:, None], values), axis=1)
+        # Frames read within the clock resolution share a time, keep strictly increasing samples only
+        keep = np.concatenate(([True], np.diff(timestamp) > 0))
+        timestamp = timestamp[keep]
+        values = values[:, keep]
+        if len(timestamp) == 0:
+            return 0
+        self._last = (timestamp[-1], values[:, -1].copy())
+        if self.rate is None:
+            if len(timestamp) < 2:
+                return 0
+            self.rate = 1.0 / float(np.median(np.diff(timestamp)))
+        if self._next is None:
+            self._next = timestamp[0]
+        count = int(np.floor((timestamp[-1] - self._next) * self.rate)) + 1
+        if count <= 0:
+            return 0
+        grid = self._next + np.arange(count) / self.rate
+        self._next = grid[-1] + 1.0 / self.rate
+        resampled = np.array([np.interp(grid, timestamp, row) for row in values])
+        self._buffer = np.concatenate((self._buffer, resampled), axis=1)
+        self._end = grid[-1]
+        return self._consume()
+
+    def _consume(self) -> int:
+        available = self._buffer.shape[1]
+        if available < self.segment:
+            return 0
+        starts = np.arange(0, available - self.segment + 1, self.hop)
+        # All complete segments of this chunk in one batched FFT
+        frames = self._buffer[:, starts[:, None] + np.arange(self.segment)]
+        frames = frames - frames.mean(axis=2, keepdims=True)
+        power = np.abs(np.fft.rfft(frames * self.window, axis=2)) ** 2
+        power /= self.rate * np.sum(self.window**2)
+        power[:, :, 1 : (self.segment + 1) // 2] *= 2
+        if self._sum is None:
+            self.frequencies = np.fft.rfftfreq(self.segment, 1.0 / self.rate)
+            self._sum = np.zeros((len(self.channels), len(self.frequencies)))
+            self.spectrogram = np.full((self.history, len(self.channels), len(self.frequencies)), np.nan)
+        self._sum += power.sum(axis=1)
+        self.segments += len(starts)
+        # Segment centre times for the spectrogram rows
+        centres = self._end - (available - 1 - starts - (self.segment - 1) / 2) / self.rate
+        for k in range(len(starts)):
+            self.spectrogram[self._row] = power[:, k]
+            self.times[self._row] = centres[k]
+            self._row = (self._row + 1) % self.history
+        self._buffer = self._buffer[:, starts[-1] + self.hop :]
+        return len(starts)
+
+    def psd(self) -> np.ndarray:
+        if self.segments == 0:
+            return None
+        return self._sum / self.segments
+
+    def rows(self) -> tuple:
+        # Spectrogram rows oldest first
+        order = np.roll(np.arange(self.history), -self._row)
+        return self.times[order], self.spectrogram[order]
@@ -0,0 +1,25 @@
+import sys
+import time
+
+
+def maxRss() -> float:
+    # Peak resident set size in MB, None where the resource module does not exist (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class StartupProfile(object):
+    def __init__(self, start: float = None) -> None:
+        self.last = time.perf_counter() if start is None else start
+        self.laps = dict()
+
+    def lap(self, name: str, since: float = None) -> None:
+        now = time.perf_counter()
+        self.laps[name] = (now - (self.last if since is None else since)) * 1000
+        if since is None:
+            self.last = now
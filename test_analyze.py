@@ -0,0 +1,23 @@
+from analyze import analyzeLog, summary
+from flightlog import MAGIC
+from test_flightlog import makeRaw, writeLog
+
+
+def test_damaged_logs_are_listed_in_a_batch(tmp_path):
+    good = str(tmp_path / "good.gslog")
+    writeLog(good, makeRaw(3000))
+    with open(good, "rb") as file:
+        data = file.read()
+    header = str(tmp_path / "header.gslog")
+    with open(header, "wb") as file:
+        file.write(MAGIC + b"\x01")
+    chunk = str(tmp_path / "chunk.gslog")
+    middle = len(data) // 2
+    with open(chunk, "wb") as file:
+        file.write(data[:middle] + bytes(64) + data[middle + 64 :])
+    results = list(map(analyzeLog, [good, header, chunk]))
+    assert "error" not in results[0]
+    assert results[0]["frames"] == 3000
+    assert "damaged header" in results[1]["error"]
+    assert "damaged chunk" in results[2]["error"]
+    assert "chunk.gslog" in summary(results)
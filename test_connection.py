@@ -0,0 +1,104 @@
+import time
+import asyncio
+import socket
+import threading
+import numpy as np
+import pytest
+import codec
+import simulator
+from events import Event
+from connection import Tower, Telemetry, BlackBox, RoundTripEstimator, WRITTEN
+from devices import Controls
+
+
+def makeFrame(k: int) -> bytes:
+    return codec.FRAME.pack(codec.TELEMETRY_TYPE, 1, k, k, -k, 0, 3277, 3277, 3277, 3277, 11700, 0, 0, 0)
+
+
+def test_telemetry_burst_is_decoded_in_batches():
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(("127.0.0.1", 0))
+    tower = Tower("127.0.0.1", sender.getsockname()[1])
+    tower.connectSignals(Event(), Event(), Event(), Event())
+    tower.connectClasses(Telemetry(), BlackBox(compact=True), Controls())
+    tower.blackbox.start_recording()
+    tower.connected = True
+    batches = []
+    callback = tower.endpoint.telemetryCallback
+    tower.endpoint.telemetryCallback = lambda datagrams, arrivals: (
+        callback(datagrams, arrivals),
+        batches.append(len(datagrams)),
+    )
+    # Queued before the loop gets to read, so the first wakeup finds the whole burst waiting
+    tower._call(_burst(sender, tower.protocol.socket.getsockname(), 200))
+    deadline = time.monotonic() + 5
+    # The batch is recorded before it is published, wait until the callback has returned for all of it
+    while sum(batches) < 200 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sender.close()
+    assert tower.blackbox.index == 200
+    assert sum(batches) == 200 and max(batches) > 1
+    assert tower.telemetry.cycletime == 199
+    assert list(tower.blackbox.column(12)) == list(range(200))
+    # Every frame keeps the time it was read rather than the time its batch was handed over
+    timestamps = tower.blackbox.timestamps()
+    assert np.all(np.diff(timestamps) >= 0)
+    assert len(np.unique(timestamps)) > 1
+    # The socket is drained from add_reader, which the Windows proactor loop does not offer
+    assert isinstance(tower.loop, asyncio.SelectorEventLoop)
+
+
+async def _burst(sender: socket.socket, addr: tuple, count: int) -> None:
+    for k in range(count):
+        sender.sendto(makeFrame(k), addr)
+
+
+def test_round_trip_estimator_backs_off_and_recovers():
+    rtt = RoundTripEstimator(minimum=0.05, maximum=4.0)
+    for _ in range(20):
+        rtt.update(0.01)
+    assert rtt.rto == pytest.approx(0.05)
+    # Every retransmission doubles the wait up to the ceiling
+    assert [rtt.timeout(attempt) for attempt in range(4)] == pytest.approx([0.05, 0.1, 0.2, 0.4])
+    assert rtt.timeout(10) == 4.0
+    rtt.update(1.0)
+    assert rtt.rto > 1.0
+    for _ in range(40):
+        rtt.update(0.01)
+    assert rtt.rto == pytest.approx(0.05)
+
+
+def test_config_write_is_acked_over_a_lossy_link():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, args=())
+    thread.daemon = True
+    thread.start()
+    transport, copter = asyncio.run_coroutine_threadsafe(simulator.serve(port=0, latency=0.005, seed=3), loop).result()
+    tower = Tower("127.0.0.1", transport.get_extra_info("sockname")[1], numberOfTries=12)
+    written = []
+    configSignal = Event()
+    configSignal.connect(lambda id, colour: written.append((id, colour)))
+    tower.connectSignals(configSignal, Event(), Event(), Event())
+    tower.connectClasses(Telemetry(), BlackBox(compact=True), Controls())
+    tower.getHandshake("127.0.0.1")
+    assert tower.connected
+    ids = sorted(copter.parameters)
+
+    # A quarter of the datagrams are lost each way, every write still has to be acked
+    copter.loss = 0.25
+    config = {id: float(k) for k, id in enumerate(ids)}
+    tower._call(tower._updateConfig(config))
+    assert sorted(written) == [(id, WRITTEN) for id in ids]
+    assert copter.parameters == config
+    sent = tower.getLinkStats()["Parameter write"]["sent"]
+    assert sent > len(ids)
+
+    # Back on a clean link nothing is retransmitted, the timeout is down to a few round trips again
+    copter.loss = 0.0
+    written.clear()
+    tower._call(tower._updateConfig({id: value + 1 for id, value in config.items()}))
+    assert sorted(written) == [(id, WRITTEN) for id in ids]
+    assert tower.getLinkStats()["Parameter write"]["sent"] == sent + len(ids)
+    assert tower.transactions.rtt.rto < 0.5
+    tower.connected = False
+    loop.call_soon_threadsafe(transport.close)
@@ -0,0 +1,20 @@
+from collections import namedtuple
+from devices import Controls, XboxController
+
+GamepadEvent = namedtuple("GamepadEvent", ["code", "state", "timestamp"])
+
+
+def test_deadzone_noise_does_not_signal_a_change():
+    controls = Controls()
+    changes = []
+    controls.changed.connect(lambda: changes.append(controls.timestamp))
+    controller = XboxController(controls, 1)
+    for k, state in enumerate([50, -120, 200, -10]):
+        controller.feed([GamepadEvent("ABS_X", state, float(k))])
+    assert controls.lx == 0 and changes == [] and controls.timestamp == 0.0
+
+    controller.feed([GamepadEvent("ABS_X", 20000, 10.0), GamepadEvent("ABS_Y", 30, 11.0)])
+    assert controls.lx > 0 and controls.ly == 0
+    assert changes == [10.0]
+    controller.feed([GamepadEvent("ABS_X", 20000, 12.0)])
+    assert changes == [10.0]
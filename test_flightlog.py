@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import codec
+from connection import Telemetry, BlackBox
+from flightlog import LogWriter, FlightLog, Replay, export
+
+
+def makeRaw(count: int) -> np.ndarray:
+    t = np.arange(count) / 50.0
+    raw = np.zeros(count, dtype=codec.DTYPE)
+    raw["type"] = codec.TELEMETRY_TYPE
+    raw["armed"] = 1
+    raw["cycletime"] = 2500
+    raw["attitude"][:, 0] = 20 * np.sin(t) * codec.ATTITUDE_SCALE
+    raw["targetAttitude"][:, 1] = 10 * np.cos(t) * codec.ATTITUDE_SCALE
+    raw["engines"][:] = 5000
+    raw["voltage"] = 3900 * codec.VOLTAGE_DIVIDER
+    return raw
+
+
+def writeLog(path: str, raw: np.ndarray, compact: bool = True) -> BlackBox:
+    blackbox = BlackBox(compact=compact)
+    blackbox.start_recording()
+    blackbox.recordFrames(raw)
+    writer = LogWriter(blackbox, path)
+    writer.start()
+    writer.stop()
+    return blackbox
+
+
+def test_log_round_trip_compact(tmp_path):
+    path = str(tmp_path / "flight.gslog")
+    blackbox = writeLog(path, makeRaw(3000))
+    log = FlightLog(path)
+    assert log.compact
+    assert len(log) == 3000
+    recorded = np.stack([blackbox.column(i) for i in range(codec.COLUMNS + 1)], axis=1)
+    np.testing.assert_array_equal(log.table(), recorded)
+
+
+def test_log_round_trip_float(tmp_path):
+    path = str(tmp_path / "flight.gslog")
+    blackbox = writeLog(path, makeRaw(3000), compact=False)
+    log = FlightLog(path)
+    assert not log.compact
+    recorded = np.stack([blackbox.column(i) for i in range(codec.COLUMNS + 1)], axis=1)
+    np.testing.assert_array_equal(log.table(), recorded)
+
+
+def test_truncated_chunk_ends_log(tmp_path):
+    path = str(tmp_path / "flight.gslog")
+    writeLog(path, makeRaw(3000))
+    size = os.path.getsize(path)
+    rows = len(FlightLog(path))
+    with open(path, "r+b") as file:
+        file.truncate(size - 10)
+    log = FlightLog(path)
+    assert len(log) < rows
+    assert len(log.table()) == len(log)
+
+
+def test_csv_export_keeps_timestamp_precision(tmp_path):
+    path = str(tmp_path / "flight.csv")
+    data = np.zeros((3, codec.COLUMNS + 1))
+    data[:, 0] = 12.3456789
+    data[:, -1] = [3600.000001, 3600.020002, 7200.5]
+    labels = ["Column {}".format(i) for i in range(codec.COLUMNS)]
+    assert export(path, [data], labels) == 3
+    loaded = np.loadtxt(path, delimiter=",", skiprows=1)
+    np.testing.assert_array_equal(loaded[:, -1], data[:, -1])
+    np.testing.assert_allclose(loaded[:, 0], data[:, 0], rtol=1e-6)
+
+
+def test_replay_records_into_blackbox(tmp_path):
+    path = str(tmp_path / "flight.gslog")
+    writeLog(path, makeRaw(2000))
+    log = FlightLog(path)
+    telemetry = Telemetry()
+    blackbox = BlackBox(compact=True)
+    blackbox.start_recording()
+    replay = Replay(log, telemetry, blackbox, speed=0)
+    replay.start()
+    replay.wait()
+    assert replay.frames == len(log) == 2000
+    assert blackbox.index == 2000
+    recorded = np.stack([blackbox.column(i) for i in range(codec.COLUMNS)], axis=1)
+    np.testing.assert_allclose(recorded, log.table()[:, : codec.COLUMNS], atol=1e-6)
+
+
+def test_logs_sharing_a_directory_are_never_replaced(tmp_path):
+    raw = makeRaw(100)
+    boxes = [BlackBox(compact=True, logDirectory=str(tmp_path)) for _ in range(2)]
+    for blackbox in boxes:
+        blackbox.start_recording()
+        blackbox.recordFrames(raw)
+    # A quick restart of the first box lands in the same second again
+    boxes[0].stop_recording()
+    boxes[0].start_recording()
+    for blackbox in boxes:
+        blackbox.stop_recording()
+    names = sorted(os.listdir(str(tmp_path)))
+    assert len(names) == 3
+    assert [len(FlightLog(str(tmp_path / name))) for name in names].count(100) == 2